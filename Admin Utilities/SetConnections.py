@@ -1,59 +1,517 @@
 import argparse
 import cloudshell.api.cloudshell_api
 import csv
+import sys
+import threading
 import time
 import os
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty
 
-parser = argparse.ArgumentParser(description='Handle command line arguments')
-parser.add_argument('FilePath', help='Path to CSV input file')
-parser.add_argument('-u', '--username', help='Quali server username', default='admin')
-parser.add_argument('-p', '--password', help='Quali server password', default='admin')
-parser.add_argument('-s', '--server', help='Address of Quali server', default='localhost')
-parser.add_argument('-d', '--domain', help='Quali domain', default='Global')
-parser.add_argument('--port', type=int, help='Quali API port', default=8029)
-parser.add_argument('-l', '--LogLocation', help='Directory to place time stamped log file', default='c:\\CloudShell\\Logs')
 
-args = parser.parse_args()
+class SessionPool(object):
+    """
+    Pool of Quali API sessions shared by the worker threads, each call borrows a session for its duration.
+    Sessions are opened on demand, up to size.
+    """
 
-l_time = time.localtime()
+    def __init__(self, args, size):
+        self.args = args
+        self.size = size
+        self._idle = Queue()
+        self._opened = 0
+        self._lock = threading.Lock()
 
-t_stamp = str(l_time.tm_year) + str(l_time.tm_mon) + str(l_time.tm_mday) + '_' + str(l_time.tm_hour) + \
-          str(l_time.tm_min) + str(l_time.tm_sec)
+    def open_session(self):
+        return cloudshell.api.cloudshell_api.CloudShellAPISession(self.args.server, self.args.username,
+                                                                  self.args.password, self.args.domain,
+                                                                  port=self.args.port)
 
-logLocation = args.LogLocation.rstrip('\\')
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            open_new = self._opened < self.size
+            if open_new:
+                self._opened += 1
+        if not open_new:
+            return self._idle.get()
+        try:
+            return self.open_session()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
 
-logFileName = args.LogLocation + '\\SetConnections_' + t_stamp + '.log'
+    def release(self, api):
+        self._idle.put(api)
 
-if not os.path.isdir(logLocation):
-    os.makedirs(logLocation)
 
-log = open(logFileName, 'w')
+class Progress(object):
+    """
+    Single console line with the number of processed rows and the rows per second, redrawn at most every
+    interval seconds
+    """
 
-try:
-    data = []
-    with open(args.FilePath) as input_file:
+    def __init__(self, total=None, interval=0.5):
+        """
+        :param int total: number of rows, None when the input is streamed without counting it first
+        """
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.started = time.time()
+        self._drawn = 0
+
+    def update(self, success):
+        self.done += 1
+        if not success:
+            self.failed += 1
+        if time.time() - self._drawn >= self.interval:
+            self.draw()
+
+    def draw(self):
+        now = time.time()
+        self._drawn = now
+        elapsed = max(now - self.started, 0.001)
+        done = str(self.done) if self.total is None else '{0}/{1}'.format(self.done, self.total)
+        sys.stdout.write('\r{0} rows, {1} failed, {2:.1f} rows/s '.format(done, self.failed, self.done / elapsed))
+        sys.stdout.flush()
+
+    def message(self, text):
+        sys.stdout.write('\r' + text.ljust(60) + '\n')
+        sys.stdout.flush()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Handle command line arguments')
+    parser.add_argument('FilePath', help='Path to CSV input file, or to the output file with --export')
+    parser.add_argument('-u', '--username', help='Quali server username', default='admin')
+    parser.add_argument('-p', '--password', help='Quali server password', default='admin')
+    parser.add_argument('-s', '--server', help='Address of Quali server', default='localhost')
+    parser.add_argument('-d', '--domain', help='Quali domain', default='Global')
+    parser.add_argument('--port', type=int, help='Quali API port', default=8029)
+    parser.add_argument('-l', '--LogLocation', help='Directory to place time stamped log file',
+                        default='c:\\CloudShell\\Logs')
+    parser.add_argument('-w', '--workers', type=int, help='Number of connections updated concurrently, each worker '
+                                                          'uses its own API session', default=8)
+    parser.add_argument('--diff', action='store_true',
+                        help='Read the current connections first and only update the rows that add, change or '
+                             'remove a connection')
+    parser.add_argument('--no-validate', action='store_true',
+                        help='Do not check the file for duplicate ports and unknown resource paths before updating')
+    parser.add_argument('--skip-invalid', action='store_true',
+                        help='Update the valid rows when the file has invalid rows, instead of updating nothing')
+    parser.add_argument('--export', nargs='+', metavar='ROOT',
+                        help='Write the current connections of the ROOT resources to FilePath, in the input format, '
+                             'instead of updating connections')
+    parser.add_argument('--resume', metavar='LOG',
+                        help='Result log of a previous run of the same file, rows it applied successfully are skipped')
+    return parser.parse_args()
+
+
+def get_log_path(log_location):
+    l_time = time.localtime()
+
+    t_stamp = str(l_time.tm_year) + str(l_time.tm_mon) + str(l_time.tm_mday) + '_' + str(l_time.tm_hour) + \
+              str(l_time.tm_min) + str(l_time.tm_sec)
+
+    logLocation = log_location.rstrip('\\')
+
+    if not os.path.isdir(logLocation):
+        os.makedirs(logLocation)
+
+    return os.path.join(logLocation, 'SetConnections_' + t_stamp + '.csv')
+
+
+class ResultLog(object):
+    """
+    CSV log with the result of every input row, in input order. The log is flushed to disk every checkpoint_rows
+    rows or checkpoint_interval seconds, so --resume finds the rows applied before the run was interrupted.
+    """
+    HEADER = ['Row', 'Source', 'Target', 'Result']
+
+    def __init__(self, path, checkpoint_rows=200, checkpoint_interval=2):
+        self.path = path
+        self.checkpoint_rows = checkpoint_rows
+        self.checkpoint_interval = checkpoint_interval
+        self._file = open(path, 'wb')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(ResultLog.HEADER)
+        self._file.flush()
+        self._rows_since_checkpoint = 0
+        self._checkpoint_time = time.time()
+
+    def write(self, row_number, source, target, result):
+        self._writer.writerow([row_number, source, target, result])
+        self._rows_since_checkpoint += 1
+        if self._rows_since_checkpoint >= self.checkpoint_rows or \
+                time.time() - self._checkpoint_time >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._rows_since_checkpoint = 0
+        self._checkpoint_time = time.time()
+
+    def close(self):
+        self.checkpoint()
+        self._file.close()
+
+
+# results of the rows that need not be sent again when resuming
+APPLIED_RESULTS = ('Success', 'Unchanged', 'Resumed')
+
+
+def load_applied_rows(log_path):
+    """
+    :return: row number -> (source, target) of the rows a previous run applied successfully
+    """
+    applied = {}
+    with open(log_path, 'rb') as log_file:
+        reader = csv.reader(log_file)
+        header = next(reader, None)
+        if header is None:
+            return applied  # killed before anything was logged
+        if header != ResultLog.HEADER:
+            raise IOError('{0} is not a SetConnections result log'.format(log_path))
+        for record in reader:
+            # the last record may be cut short if the previous run was killed while writing it
+            if len(record) == 4 and record[3] in APPLIED_RESULTS and record[0].isdigit():
+                applied[int(record[0])] = (record[1], record[2])
+    return applied
+
+
+def read_rows(file_path):
+    """
+    Streams the input file
+    :return: (line number, row) of every non empty row
+    """
+    with open(file_path) as input_file:
         datareader = csv.reader(input_file)
         for row in datareader:
-            data.append(row)
-except IOError as exc:
-    print "Unable to read file " + args.FilePath
-    exit()
-
-api = None
-try:
-    api = cloudshell.api.cloudshell_api.CloudShellAPISession(args.server, args.username, args.password, args.domain,
-                                                             port=args.port)
-
-except Exception as exc:
-    print 'Unable to connect to Quali server'
-    print str(exc)
-    exit()
-
-for row in data:
+            if row:
+                yield datareader.line_num, row
+
+
+class CompletedResult(object):
+    """
+    Stands in for the AsyncResult of a row that needs no API call
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def ready(self):
+        return True
+
+    def get(self):
+        return self.value
+
+
+def get_root(path):
+    return path.split('/')[0]
+
+
+def read_resource_tree(api, root):
+    """
+    :return: full paths (lower case) of root and all its sub-resources, and (port full path, connected port
+             full path) of every connected port under root
+    """
+    paths = set()
+    connections = []
+    pending = [(root, api.GetResourceDetails(root))]
+    while pending:
+        path, resource = pending.pop()
+        paths.add(path.lower())
+        for connection in resource.Connections or []:
+            connections.append((path, connection.FullPath))
+        for child in resource.ChildResources or []:
+            child_path = child.Name if '/' in child.Name else path + '/' + child.Name
+            pending.append((child_path, child))
+    return paths, connections
+
+
+def read_resource_trees(pool, roots, workers):
+    """
+    Reads the resource tree of every root concurrently, one GetResourceDetails call per root
+    :return: the known resource paths (lower case), port full path (lower case) -> connected port full path,
+             and the roots that could not be read
+    """
+    def read(root):
+        try:
+            api = pool.acquire()
+        except Exception:
+            return root, None
+        try:
+            return root, read_resource_tree(api, root)
+        except Exception:
+            return root, None
+        finally:
+            pool.release(api)
+
+    paths = set()
+    index = {}
+    unreadable = set()
+    threads = ThreadPool(max(1, min(workers, len(roots))))
+    try:
+        for root, tree in threads.imap_unordered(read, roots):
+            if tree is None:
+                unreadable.add(root.lower())
+            else:
+                paths.update(tree[0])
+                index.update((port.lower(), peer) for port, peer in tree[1])
+    finally:
+        threads.close()
+        threads.join()
+    return paths, index, unreadable
+
+
+def add_problem(problems, row_number, problem):
+    problems[row_number] = problems[row_number] + '; ' + problem if row_number in problems else problem
+
+
+def scan_rows(file_path):
+    """
+    Single pass over the input file, indexing every port it names
+    :return: number of rows, resource names, port (lower case) -> (line number, port) and line number -> problem
+             of the rows that are malformed or use a port already used by another row
+    """
+    total = 0
+    roots = set()
+    ports = {}
+    problems = {}
+
+    for row_number, row in read_rows(file_path):
+        total += 1
+        if len(row) < 2 or not row[0]:
+            add_problem(problems, row_number, 'Invalid row, expected source and target')
+            continue
+        source, target = row[0], row[1]
+        if target and source.lower() == target.lower():
+            add_problem(problems, row_number, 'Port connected to itself')
+            continue
+        for port in (source, target):
+            if not port:
+                continue
+            roots.add(get_root(port))
+            if port.lower() in ports:
+                other_row = ports[port.lower()][0]
+                add_problem(problems, row_number, '{0} is also used in row {1}'.format(port, other_row))
+                add_problem(problems, other_row, '{0} is also used in row {1}'.format(port, row_number))
+            else:
+                ports[port.lower()] = (row_number, port)
+    return total, roots, ports, problems
+
+
+def find_unknown_ports(ports, paths, unreadable, problems):
+    """
+    Adds a problem for every row that names a port missing from the resource trees
+    """
+    for row_number, port in ports.values():
+        if get_root(port).lower() in unreadable:
+            problem = 'Unknown resource ' + get_root(port)
+        elif port.lower() not in paths:
+            problem = 'Unknown resource path ' + port
+        else:
+            continue
+        add_problem(problems, row_number, problem)
+
+
+def classify(row, index, unreadable):
+    """
+    :return: 'Unchanged', 'Added', 'Changed' or 'Removed', compared to the current connections
+    """
+    source, target = row[0], row[1]
+    current = index.get(source.lower())
+    if get_root(source).lower() in unreadable or (target and get_root(target).lower() in unreadable):
+        return 'Changed'  # current state unknown, always update
+    if not target:
+        return 'Removed' if current else 'Unchanged'
+    if current is None:
+        return 'Added'
+    return 'Unchanged' if current.lower() == target.lower() else 'Changed'
+
+
+def export_connections(pool, roots, workers, output_path):
+    """
+    Writes every connection under the roots once, as they are read
+    :return: number of connections written and the roots that could not be read
+    """
+    def read(root):
+        try:
+            api = pool.acquire()
+        except Exception as exc:
+            return root, None, exc
+        try:
+            return root, read_resource_tree(api, root)[1], None
+        except Exception as exc:
+            return root, None, exc
+        finally:
+            pool.release(api)
+
+    written = set()
+    unreadable = []
+    with open(output_path, 'wb') as output_file:
+        writer = csv.writer(output_file)
+        threads = ThreadPool(max(1, min(workers, len(roots))))
+        try:
+            for root, connections, error in threads.imap_unordered(read, roots):
+                if connections is None:
+                    print 'Unable to read {0}: {1}'.format(root, error)
+                    unreadable.append(root)
+                    continue
+                for port, peer in connections:
+                    link = frozenset([port.lower(), peer.lower()])
+                    if link not in written:
+                        written.add(link)
+                        writer.writerow([port, peer])
+                output_file.flush()
+        finally:
+            threads.close()
+            threads.join()
+    return len(written), unreadable
+
+
+def update_connection(pool, row):
+    """
+    :return: (row, 'Success' or the error message)
+    """
+    if len(row) < 2:
+        return row, 'Invalid row, expected source and target'
+    try:
+        api = pool.acquire()
+    except Exception as exc:
+        return row, 'Unable to connect to Quali server: ' + str(exc)
     try:
         api.UpdatePhysicalConnection(row[0], row[1])
-        print '{0}-{1}: Success'.format(row[0], row[1])
-        log.write('{0},{1},Success{2}'.format(row[0], row[1], os.linesep))
+        return row, 'Success'
     except Exception as exc:
-        print '{0}-{1}: {2}'.format(row[0], row[1], exc.message)
-        log.write('{0},{1},{2}{3}'.format(row[0], row[1], exc.message, os.linesep))
+        return row, exc.message or str(exc)
+    finally:
+        pool.release(api)
+
+
+def main():
+    args = parse_args()
+
+    applied = {}
+    if args.resume:
+        try:
+            applied = load_applied_rows(args.resume)
+        except IOError as exc:
+            print 'Unable to read log ' + args.resume
+            print str(exc)
+            exit()
+        print 'Resuming, {0} rows already applied according to {1}'.format(len(applied), args.resume)
+
+    workers = max(1, args.workers)
+    pool = SessionPool(args, workers)
+    try:
+        pool.release(pool.open_session())
+    except Exception as exc:
+        print 'Unable to connect to Quali server'
+        print str(exc)
+        exit()
+
+    if args.export:
+        started = time.time()
+        count, unreadable = export_connections(pool, args.export, workers, args.FilePath)
+        print 'Exported {0} connections of {1} resources to {2} in {3:.1f}s'.format(
+            count, len(args.export) - len(unreadable), args.FilePath, time.time() - started)
+        exit(1 if unreadable else 0)
+
+    index = None
+    unreadable = set()
+    problems = {}
+    total = None
+    try:
+        if args.diff or not args.no_validate:
+            # only the ports are kept from this first pass over the file
+            total, roots, ports, problems = scan_rows(args.FilePath)
+            print 'Reading {0} resources'.format(len(roots))
+            paths, index, unreadable = read_resource_trees(pool, sorted(roots), workers)
+            if args.no_validate:
+                problems = {}
+                for root in sorted(unreadable):
+                    print 'Unable to read connections of {0}, its rows are always updated'.format(root)
+            else:
+                find_unknown_ports(ports, paths, unreadable, problems)
+            if not args.diff:
+                index = None
+        rows = read_rows(args.FilePath)
+        row_number, row = next(rows, (None, None))  # fail here, not halfway, if the file can't be read
+    except IOError as exc:
+        print "Unable to read file " + args.FilePath
+        exit()
+
+    if problems:
+        for problem_row in sorted(problems):
+            print 'Row {0}: {1}'.format(problem_row, problems[problem_row])
+        if not args.skip_invalid:
+            print '{0} invalid rows, no connection was updated'.format(len(problems))
+            exit(1)
+        print '{0} invalid rows are skipped'.format(len(problems))
+
+    log = ResultLog(get_log_path(args.LogLocation))
+    print 'Logging results to ' + log.path
+
+    def apply_row(row_number, row):
+        kind = None
+        if row_number in problems:
+            return row_number, row, 'Invalid: ' + problems[row_number], kind
+        if index is not None and len(row) >= 2:
+            kind = classify(row, index, unreadable)
+            if kind == 'Unchanged':
+                return row_number, row, kind, kind
+        row, result = update_connection(pool, row)
+        return row_number, row, result, kind
+
+    progress = Progress(total)
+    counts = {}
+
+    def log_result(pending_result):
+        row_number, row, result, kind = pending_result.get()
+        source, target = (row + ['', ''])[:2]
+        success = result in APPLIED_RESULTS
+        if not success:
+            progress.message('{0}-{1}: {2}'.format(source, target, result))
+        progress.update(success)
+        key = (kind or result) if success else 'Failed'
+        counts[key] = counts.get(key, 0) + 1
+        log.write(row_number, source, target, result)
+
+    # rows are updated concurrently, at most window rows are read ahead of the oldest row not logged yet,
+    # results are logged in the order of the input file
+    window = workers * 4
+    pending = deque()
+    threads = ThreadPool(workers)
+    try:
+        while row_number is not None:
+            if applied.get(row_number) == tuple((row + ['', ''])[:2]):
+                pending.append(CompletedResult((row_number, row, 'Resumed', None)))
+            else:
+                pending.append(threads.apply_async(apply_row, (row_number, row)))
+            while pending and (len(pending) >= window or pending[0].ready()):
+                log_result(pending.popleft())
+            row_number, row = next(rows, (None, None))
+        while pending:
+            log_result(pending.popleft())
+    finally:
+        threads.close()
+        threads.join()
+        log.close()
+    progress.draw()
+    print
+    print ', '.join('{0}: {1}'.format(key, counts.get(key, 0)) for key in
+                    (['Unchanged', 'Added', 'Changed', 'Removed'] if args.diff else ['Success']) +
+                    (['Resumed'] if args.resume else []) + ['Failed'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Local stand-in for the CloudShell API, used by the benchmarks: a simulated reservation of deployable apps and GigaVue
+devices whose API calls and commands take a configurable time. Only the calls made by the environment scripts exist.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+
+from cloudshell.api.common_cloudshell_api import CloudShellAPIError
+
+RESOURCE_BUSY_ERROR = 'Resource temporarily unavailable'
+DEVICE_COMMANDS = ['load_firmware', 'reset', 'restore_device_id', 'get_running_config']
+
+
+class ApiObject(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class InputNameValue(ApiObject):
+    def __init__(self, Name, Value):
+        ApiObject.__init__(self, Name=Name, Value=Value)
+
+
+class DeployAppInput(ApiObject):
+    def __init__(self, AppName, Name, Value):
+        ApiObject.__init__(self, AppName=AppName, Name=Name, Value=Value)
+
+
+class ReservationDescriptionInfo(ApiObject):
+    pass
+
+
+class Lab(object):
+    """
+    State and timings of the simulated reservation, shared by every API session of the process
+    """
+    DEFAULTS = {
+        'reservation_id': 'benchmark-reservation',
+        'apps': 2,                  # deployable apps in the reservation
+        'devices': 4,               # GigaVue devices
+        'ports': 4,                 # ports of every device
+        'routes': 2,                # disconnected routes between ports of neighbouring devices
+        'latency': 0.02,            # seconds taken by every API call
+        'latencies': {},            # API method -> seconds, overrides latency
+        'deploy_duration': 2.0,     # seconds taken by DeployAppToCloudProviderBulk, whatever the number of apps
+        'connected_command_duration': 1.0,  # seconds taken by PowerOn, PowerOff and remote_refresh_ip
+        'autoload_duration': 1.0,
+        'routes_duration': 0.5,     # seconds taken by ConnectRoutesInReservation and DisconnectRoutesInReservation
+        'cleanup_duration': 0.5,
+        'command_duration': 5.0,    # seconds a device stays busy after EnqueueCommand
+        'command_durations': {},    # command name -> seconds, overrides command_duration
+        'device_model': 'HD8',
+        'running_version': None,    # software version the devices report, None when not reported
+        'busy_every': 0,            # every Nth EnqueueCommand is rejected as busy, 0 never
+        'config_changed': False,    # devices report a different running config in every process
+        'deployed': False,          # the apps are already deployed, as when teardown runs
+        'ftp_host': '127.0.0.1'
+    }
+
+    def __init__(self, **settings):
+        unknown = set(settings) - set(Lab.DEFAULTS)
+        if unknown:
+            raise ValueError('Unknown lab settings: ' + ', '.join(sorted(unknown)))
+        self.settings = dict(Lab.DEFAULTS, **settings)
+        self.reservation_id = self.settings['reservation_id']
+        self.apps = ['App-{0}'.format(index + 1) for index in range(self.settings['apps'])]
+        self.devices = ['GigaVue-{0}'.format(index + 1) for index in range(self.settings['devices'])]
+        self.deployed = set(self.apps) if self.settings['deployed'] else set()
+        self.calls = defaultdict(int)
+        self.busy_until = {}
+        self._config_token = '{0:08x}'.format(random.getrandbits(32))
+        self._lock = threading.Lock()
+
+    def call(self, method):
+        """
+        Counts a call of an API method and waits for its latency
+        :param str method:
+        :return: number of calls of the method so far, this one included
+        :rtype: int
+        """
+        with self._lock:
+            self.calls[method] += 1
+            count = self.calls[method]
+        time.sleep(self.settings['latencies'].get(method, self.settings['latency']))
+        return count
+
+    def device_address(self, device):
+        return '10.0.0.{0}'.format(self.devices.index(device) + 1)
+
+    def resources(self):
+        tftp = ApiObject(Name='TFTP Server', FullAddress=self.settings['ftp_host'],
+                         ResourceModelName='Generic TFTP Server', CreatedInReservation=None)
+        resources = [tftp]
+        for device in self.devices:
+            address = self.device_address(device)
+            resources.append(ApiObject(Name=device, FullAddress=address, ResourceModelName='GigaVue',
+                                       CreatedInReservation=None))
+            for port in range(self.settings['ports']):
+                resources.append(ApiObject(Name='{0}/Port {1}'.format(device, port + 1),
+                                           FullAddress='{0}/{1}'.format(address, port + 1),
+                                           ResourceModelName='GigaVue Port', CreatedInReservation=None))
+        with self._lock:
+            deployed = sorted(self.deployed)
+        for app in deployed:
+            resources.append(ApiObject(Name=app, FullAddress='192.168.0.{0}'.format(self.apps.index(app) + 1),
+                                       ResourceModelName='Generic App Model',
+                                       CreatedInReservation=self.reservation_id))
+        return resources
+
+    def connectors(self):
+        connectors = []
+        for index in range(self.settings['routes']):
+            if len(self.devices) < 2 or self.settings['ports'] < 1:
+                break
+            source = self.devices[index % len(self.devices)]
+            target = self.devices[(index + 1) % len(self.devices)]
+            port = '/Port {0}'.format(index // len(self.devices) % self.settings['ports'] + 1)
+            connectors.append(ApiObject(Source=source + port, Target=target + port, State='Disconnected'))
+        return connectors
+
+    def running_config(self, device):
+        config = '! generated {0}\nhostname {1}\n'.format(time.strftime('%H:%M:%S'), device)
+        if self.settings['config_changed']:
+            # differs between the setup and the teardown process
+            config += 'port-list {0}\n'.format(self._config_token)
+        return config
+
+
+_lab = Lab()
+
+
+def configure(**settings):
+    """
+    Replaces the simulated reservation
+    :return: the new lab
+    :rtype: Lab
+    """
+    global _lab
+    _lab = Lab(**settings)
+    return _lab
+
+
+def get_lab():
+    """
+    :rtype: Lab
+    """
+    return _lab
+
+
+class CloudShellAPISession(object):
+    def __init__(self, host=None, username=None, password=None, domain=None, *args, **kwargs):
+        self.lab = _lab
+
+    def GetReservationDetails(self, reservationId):
+        lab = self.lab
+        lab.call('GetReservationDetails')
+        with lab._lock:
+            undeployed = [app for app in lab.apps if app not in lab.deployed]
+        apps = [ApiObject(Name=app) for app in undeployed] or [ApiObject(Name='')]
+        return ApiObject(ReservationDescription=ReservationDescriptionInfo(
+            Id=reservationId, Resources=lab.resources(), Apps=apps, Connectors=lab.connectors()))
+
+    def GetResourceDetails(self, resourceFullPath, showAllDomains=False):
+        lab = self.lab
+        lab.call('GetResourceDetails')
+        if resourceFullPath in lab.apps:
+            vm_details = ApiObject(UID='vm-' + resourceFullPath, VmCustomParams=[])
+            return ApiObject(Name=resourceFullPath, ResourceModelName='Generic App Model', ResourceAttributes=[],
+                             VmDetails=vm_details, ChildResources=[])
+        attributes = [ApiObject(Name='Storage username', Value='benchmark'),
+                      ApiObject(Name='Storage password', Value='benchmark')]
+        if resourceFullPath in lab.devices:
+            attributes.append(ApiObject(Name='Model', Value=lab.settings['device_model']))
+            if lab.settings['running_version']:
+                attributes.append(ApiObject(Name='OS Version', Value=lab.settings['running_version']))
+        return ApiObject(Name=resourceFullPath, ResourceModelName='GigaVue', ResourceAttributes=attributes,
+                         VmDetails=None, ChildResources=[])
+
+    def GetResourceCommands(self, resourceFullPath):
+        lab = self.lab
+        lab.call('GetResourceCommands')
+        names = DEVICE_COMMANDS if resourceFullPath.split('/')[0] in lab.devices else []
+        return ApiObject(Commands=[ApiObject(Name=name, Parameters=[]) for name in names])
+
+    def DeployAppToCloudProviderBulk(self, reservationId, appNames, commandInputs=None):
+        lab = self.lab
+        lab.call('DeployAppToCloudProviderBulk')
+        time.sleep(lab.settings['deploy_duration'])
+        with lab._lock:
+            lab.deployed.update(appNames)
+        return ApiObject(ResultItems=[
+            ApiObject(Success=True, Error='', AppName=name, AppInstallationInfo=None,
+                      AppDeploymentyInfo=ApiObject(LogicalResourceName=name, VmUuid='vm-' + name))
+            for name in appNames])
+
+    def ConnectRoutesInReservation(self, reservationId, endpoints, mappingType=None):
+        self.lab.call('ConnectRoutesInReservation')
+        time.sleep(self.lab.settings['routes_duration'])
+
+    def DisconnectRoutesInReservation(self, reservationId, endpoints):
+        self.lab.call('DisconnectRoutesInReservation')
+        time.sleep(self.lab.settings['routes_duration'])
+
+    def ExecuteResourceConnectedCommand(self, reservationId, resourceFullPath, commandName, commandTag,
+                                        parameterValues=None, connectedPortsFullPath=None, printOutput=False):
+        self.lab.call('ExecuteResourceConnectedCommand')
+        time.sleep(self.lab.settings['connected_command_duration'])
+
+    def AutoLoad(self, resourceFullPath):
+        self.lab.call('AutoLoad')
+        time.sleep(self.lab.settings['autoload_duration'])
+
+    def InstallApp(self, reservationId, resourceName, commandName, commandInputs=None, printOutput=False):
+        self.lab.call('InstallApp')
+
+    def EnqueueCommand(self, reservationId, targetName, targetType, commandName, commandInputs=None,
+                       printOutput=False):
+        lab = self.lab
+        count = lab.call('EnqueueCommand')
+        if lab.settings['busy_every'] and count % lab.settings['busy_every'] == 0:
+            raise CloudShellAPIError('100', RESOURCE_BUSY_ERROR)
+        duration = lab.settings['command_durations'].get(commandName, lab.settings['command_duration'])
+        with lab._lock:
+            lab.busy_until[targetName] = time.time() + duration
+
+    def GetResourceLiveStatus(self, resourceFullName):
+        lab = self.lab
+        lab.call('GetResourceLiveStatus')
+        with lab._lock:
+            busy_until = lab.busy_until.get(resourceFullName, 0)
+        if time.time() < busy_until:
+            return ApiObject(liveStatusName='Progress 10', liveStatusDescription='Command running')
+        return ApiObject(liveStatusName='Online', liveStatusDescription='Command completed')
+
+    def ExecuteCommand(self, reservationId, targetName, targetType, commandName, commandInputs=None,
+                       printOutput=False):
+        lab = self.lab
+        lab.call('ExecuteCommand')
+        time.sleep(lab.settings['command_durations'].get(commandName, 0))
+        return ApiObject(Output=lab.running_config(targetName))
+
+    def WriteMessageToReservationOutput(self, reservationId, message):
+        self.lab.call('WriteMessageToReservationOutput')
+
+    def RemoveResourcesFromReservation(self, reservationId, resourcesFullPath, deleteDeployedApps=True):
+        lab = self.lab
+        lab.call('RemoveResourcesFromReservation')
+        with lab._lock:
+            lab.deployed.difference_update(resourcesFullPath)
+
+    def CleanupSandboxConnectivity(self, reservationId):
+        self.lab.call('CleanupSandboxConnectivity')
+        time.sleep(self.lab.settings['cleanup_duration'])
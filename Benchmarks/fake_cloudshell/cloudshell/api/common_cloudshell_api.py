@@ -0,0 +1,6 @@
+class CloudShellAPIError(Exception):
+    def __init__(self, code, message, rawxml=''):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.rawxml = rawxml
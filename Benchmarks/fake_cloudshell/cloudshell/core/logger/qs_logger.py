@@ -0,0 +1,11 @@
+import logging
+
+_handler = logging.StreamHandler()
+_handler.setFormatter(logging.Formatter('%(asctime)s %(threadName)s %(name)s %(levelname)s %(message)s'))
+
+
+def get_qs_logger(log_file_prefix='QuaiLogger', log_group='Ungrouped', log_category='QS'):
+    logger = logging.getLogger(log_category)
+    if _handler not in logger.handlers:
+        logger.addHandler(_handler)
+    return logger
@@ -0,0 +1,32 @@
+"""
+Reservation context of the benchmarks, in place of the one CloudShell passes to the scripts
+"""
+from cloudshell.api.cloudshell_api import ApiObject, CloudShellAPISession, get_lab
+
+_context = {
+    'environment_name': 'Benchmark',
+    'global_inputs': {}
+}
+
+
+def set_reservation_context(environment_name, global_inputs):
+    """
+    :param str environment_name:
+    :param dict global_inputs: global input name -> value
+    """
+    _context['environment_name'] = environment_name
+    _context['global_inputs'] = dict(global_inputs)
+
+
+def get_api_session():
+    return CloudShellAPISession()
+
+
+def get_reservation_context_details():
+    return ApiObject(id=get_lab().reservation_id, environment_name=_context['environment_name'],
+                     parameters=ApiObject(global_inputs=_context['global_inputs'], resource_requirements={},
+                                          resource_additional_info={}))
+
+
+def get_global_inputs():
+    return _context['global_inputs']
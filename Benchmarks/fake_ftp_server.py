@@ -0,0 +1,178 @@
+"""
+Minimal FTP server serving files from memory, in place of the reservation's TFTP server in the benchmarks.
+Anonymous and any user/password logins are accepted, data connections are passive only.
+"""
+import SocketServer
+import socket
+import threading
+import time
+
+DEFAULT_VERSION_INDEX = '\r\n'.join([
+    'HD8,4.6,hdccv2_2016-05-19.img',
+    'HD8,4.7,hdccv2_2016-09-08_gm.img',
+    'HC2,4.6,hc2_2016-05-19.img',
+    'HC2,4.7,hc2_2016-09-08_gm.img'
+]) + '\r\n'
+
+
+class FtpHandler(SocketServer.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        self.data_listener = None
+        self.reply('220 Benchmark FTP server')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command, _, argument = line.strip().partition(' ')
+            command = command.upper()
+            handler = getattr(self, 'ftp_' + command, None)
+            if handler is None:
+                self.reply('502 Command not implemented')
+            elif handler(argument.lstrip('/')) is False:
+                break
+        self._close_data_listener()
+
+    def _file(self, name):
+        entry = self.server.files.get(name)
+        if entry is None:
+            self.reply('550 ' + name + ': No such file')
+        return entry
+
+    def _open_data_connection(self):
+        if self.data_listener is None:
+            self.reply('425 Use PASV first')
+            return None
+        self.data_listener.settimeout(10)
+        try:
+            connection, _ = self.data_listener.accept()
+        finally:
+            self._close_data_listener()
+        return connection
+
+    def _close_data_listener(self):
+        if self.data_listener is not None:
+            self.data_listener.close()
+            self.data_listener = None
+
+    def _send_data(self, content):
+        connection = self._open_data_connection()
+        if connection is None:
+            return
+        self.reply('150 Opening data connection')
+        try:
+            connection.sendall(content)
+        finally:
+            connection.close()
+        self.reply('226 Transfer complete')
+
+    def ftp_USER(self, argument):
+        self.reply('331 Password required')
+
+    def ftp_PASS(self, argument):
+        self.reply('230 Logged in')
+
+    def ftp_SYST(self, argument):
+        self.reply('215 UNIX Type: L8')
+
+    def ftp_FEAT(self, argument):
+        self.wfile.write('211-Features:\r\n MDTM\r\n MLST modify*;size*;type*;\r\n SIZE\r\n')
+        self.reply('211 End')
+
+    def ftp_TYPE(self, argument):
+        self.reply('200 Type set to ' + argument)
+
+    def ftp_PWD(self, argument):
+        self.reply('257 "/" is the current directory')
+
+    def ftp_CWD(self, argument):
+        self.reply('250 Directory changed')
+
+    def ftp_NOOP(self, argument):
+        self.reply('200 OK')
+
+    def ftp_QUIT(self, argument):
+        self.reply('221 Goodbye')
+        return False
+
+    def ftp_PASV(self, argument):
+        self._close_data_listener()
+        self.data_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.data_listener.bind((self.server.server_address[0], 0))
+        self.data_listener.listen(1)
+        host, port = self.data_listener.getsockname()
+        self.reply('227 Entering Passive Mode ({0},{1},{2})'.format(host.replace('.', ','), port >> 8, port & 0xff))
+
+    def ftp_SIZE(self, argument):
+        entry = self._file(argument)
+        if entry is not None:
+            self.reply('213 {0}'.format(len(entry[0])))
+
+    def ftp_MDTM(self, argument):
+        entry = self._file(argument)
+        if entry is not None:
+            self.reply('213 ' + time.strftime('%Y%m%d%H%M%S', time.gmtime(entry[1])))
+
+    def ftp_MLST(self, argument):
+        if not argument or argument in self.server.directories():
+            modified = max([entry[1] for entry in self.server.files.values()] or [time.time()])
+            facts = 'type=dir;modify={0};'.format(time.strftime('%Y%m%d%H%M%S', time.gmtime(modified)))
+        else:
+            entry = self._file(argument)
+            if entry is None:
+                return
+            facts = 'type=file;size={0};modify={1};'.format(len(entry[0]),
+                                                            time.strftime('%Y%m%d%H%M%S', time.gmtime(entry[1])))
+        self.wfile.write('250-Listing ' + argument + '\r\n ' + facts + ' /' + argument + '\r\n')
+        self.reply('250 End')
+
+    def ftp_RETR(self, argument):
+        entry = self._file(argument)
+        if entry is not None:
+            self._send_data(entry[0])
+
+    def ftp_NLST(self, argument):
+        prefix = argument.rstrip('/') + '/' if argument else ''
+        names = sorted(name for name in self.server.files if name.startswith(prefix))
+        self._send_data(''.join(name + '\r\n' for name in names))
+
+    def ftp_LIST(self, argument):
+        self.ftp_NLST(argument)
+
+
+class FakeFtpServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, files=None, host='127.0.0.1', port=0):
+        """
+        :param dict files: path -> content, version_index.txt is served when not given
+        :param str host:
+        :param int port: 0 picks a free port
+        """
+        SocketServer.TCPServer.__init__(self, (host, port), FtpHandler)
+        now = time.time()
+        if files is None:
+            files = {'version_index.txt': DEFAULT_VERSION_INDEX}
+        self.files = dict((path, (content, now)) for path, content in files.items())
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def directories(self):
+        return set(path.rsplit('/', 1)[0] for path in self.files if '/' in path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='FakeFtpServer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,287 @@
+"""
+Runs the IntlTAC environment setup and teardown against a local stand-in for the CloudShell API and a local FTP
+server serving version_index.txt, and reports wall clock time, API call counts and peak threads per scenario.
+
+    python Benchmarks/run_benchmarks.py                     # all scenarios
+    python Benchmarks/run_benchmarks.py -s small -s busy_server --json results.json
+    python Benchmarks/run_benchmarks.py -s pod -g quali_tracing=/tmp/traces
+
+Every script runs in its own Python process: the Setup and Teardown packages both import as sandbox_scripts.
+Setup and teardown of a scenario share a temporary directory, holding the firmware index cache and the config
+baseline, which is removed afterwards unless --keep is given.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+FAKE_CLOUDSHELL_DIR = os.path.join(BENCHMARKS_DIR, 'fake_cloudshell')
+SCRIPT_PACKAGES = {
+    'setup': os.path.join(REPO_DIR, 'Environment Scripts', 'IntlTAC Setup'),
+    'teardown': os.path.join(REPO_DIR, 'Environment Scripts', 'IntlTAC Teardown')
+}
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+# lab: settings of the simulated reservation, see cloudshell.api.cloudshell_api.Lab.DEFAULTS
+SCENARIOS = [
+    ('small', {
+        'description': '1 app, 2 devices',
+        'lab': {'apps': 1, 'devices': 2, 'ports': 2, 'routes': 1},
+        'global_inputs': {'GigaVue Version': '4.7'}
+    }),
+    ('pod', {
+        'description': '4 apps, 8 devices of 8 ports',
+        'lab': {'apps': 4, 'devices': 8, 'ports': 8, 'routes': 4},
+        'global_inputs': {'GigaVue Version': '4.7'}
+    }),
+    ('large', {
+        'description': '12 apps, 48 devices of 24 ports',
+        'lab': {'apps': 12, 'devices': 48, 'ports': 24, 'routes': 24},
+        'global_inputs': {'GigaVue Version': '4.7'}
+    }),
+    ('same_version', {
+        'description': '8 devices already running the requested version',
+        'lab': {'apps': 2, 'devices': 8, 'ports': 4, 'running_version': '4.7.00'},
+        'global_inputs': {'GigaVue Version': '4.7'}
+    }),
+    ('no_firmware', {
+        'description': '4 apps, 8 devices, no GigaVue Version input',
+        'lab': {'apps': 4, 'devices': 8, 'ports': 4},
+        'global_inputs': {}
+    }),
+    ('busy_server', {
+        'description': '16 devices, every 3rd command rejected as busy',
+        'lab': {'apps': 2, 'devices': 16, 'ports': 4, 'busy_every': 3},
+        'global_inputs': {'GigaVue Version': '4.7'}
+    }),
+    ('slow_api', {
+        'description': '4 apps, 8 devices, 200 ms per API call',
+        'lab': {'apps': 4, 'devices': 8, 'ports': 4, 'latency': 0.2},
+        'global_inputs': {'GigaVue Version': '4.7'}
+    }),
+    ('changed_config', {
+        'description': '8 devices whose config changes during the reservation',
+        'lab': {'apps': 2, 'devices': 8, 'ports': 4, 'config_changed': True},
+        'global_inputs': {'GigaVue Version': '4.7'}
+    })
+]
+
+
+class PeakThreadMonitor(object):
+    """
+    Samples the number of live threads of the process, its own thread excluded
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.peak = threading.active_count()
+        self._thread = threading.Thread(target=self._run, name='PeakThreadMonitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peak
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count() - 1)
+
+
+def run_script(script, scenario, work_dir, global_inputs):
+    """
+    Runs one environment script in the current process, to be called in a fresh interpreter
+    :param str script: 'setup' or 'teardown'
+    :param dict scenario:
+    :param str work_dir: temporary directory of the scenario
+    :param dict global_inputs: reservation global inputs, added to the ones of the scenario
+    :return: wall clock seconds, API calls per method, peak threads and error of the script
+    :rtype: dict
+    """
+    # the firmware index cache and the config baseline live in the temporary directory, set before they import
+    tempfile.tempdir = work_dir
+    sys.path.insert(0, FAKE_CLOUDSHELL_DIR)
+    sys.path.insert(0, SCRIPT_PACKAGES[script])
+
+    import ftplib
+    from cloudshell.api import cloudshell_api
+    from cloudshell.helpers.scripts import cloudshell_scripts_helpers as helpers
+    from fake_ftp_server import FakeFtpServer
+
+    lab = cloudshell_api.configure(deployed=script == 'teardown', **scenario['lab'])
+    helpers.set_reservation_context('Benchmark', dict(scenario['global_inputs'], **global_inputs))
+
+    ftp_server = FakeFtpServer(host=lab.settings['ftp_host']).start()
+    ftplib.FTP.port = ftp_server.port  # the scripts connect to the TFTP server address on the default port
+
+    if script == 'setup':
+        from sandbox_scripts.environment.setup.setup_script import EnvironmentSetup as Environment
+    else:
+        from sandbox_scripts.environment.teardown.teardown_script import EnvironmentTeardown as Environment
+
+    monitor = PeakThreadMonitor()
+    error = None
+    started = time.time()
+    monitor.start()
+    try:
+        Environment().execute()
+    except Exception as exc:
+        error = '{0}: {1}'.format(type(exc).__name__, exc)
+    wall = time.time() - started
+    peak_threads = monitor.stop()
+    ftp_server.stop()
+
+    return {
+        'wall': wall,
+        'api_calls': dict(lab.calls),
+        'peak_threads': peak_threads,
+        'error': error
+    }
+
+
+def run_scenario(python, name, verbose, keep, global_inputs):
+    """
+    Runs the setup then the teardown of a scenario, each in a child process
+    :param str python: interpreter running the scripts
+    :param str name: scenario name
+    :param bool verbose: show the logs of the scripts
+    :param bool keep: keep the temporary directory of the scenario
+    :param dict global_inputs: added to the global inputs of the scenario
+    :return: script -> result as returned by run_script
+    :rtype: dict
+    """
+    work_dir = tempfile.mkdtemp(prefix='benchmark_{0}_'.format(name))
+    results = {}
+    try:
+        for script in ('setup', 'teardown'):
+            command = [python, os.path.abspath(__file__), '--run-script', script, '--work-dir', work_dir,
+                       '--scenario', name]
+            for input_name, value in sorted(global_inputs.items()):
+                command.extend(['--global-input', '{0}={1}'.format(input_name, value)])
+            if verbose:
+                command.append('--verbose')
+            log_path = os.path.join(work_dir, script + '.log')
+            with open(log_path, 'w') as log_file:
+                child = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=None if verbose else log_file,
+                                         cwd=work_dir)
+                output = child.communicate()[0]
+            result = None
+            for line in output.splitlines():
+                if line.startswith(RESULT_PREFIX):
+                    result = json.loads(line[len(RESULT_PREFIX):])
+                elif verbose:
+                    sys.stdout.write(line + '\n')
+            if result is None:
+                result = {'wall': None, 'api_calls': {}, 'peak_threads': None,
+                          'error': 'exited with code {0}, see {1}'.format(child.returncode, log_path)}
+                keep = True
+            results[script] = result
+    finally:
+        if keep:
+            sys.stderr.write('Kept {0}\n'.format(work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def format_table(results):
+    """
+    :param list results: (scenario name, script, result) tuples
+    :rtype: str
+    """
+    rows = [('Scenario', 'Script', 'Wall s', 'API calls', 'Peak threads', 'Top API methods', 'Error')]
+    for name, script, result in results:
+        calls = result['api_calls']
+        top = sorted(calls.items(), key=lambda item: (-item[1], item[0]))[:3]
+        rows.append((name, script,
+                     '{0:.2f}'.format(result['wall']) if result['wall'] is not None else '-',
+                     str(sum(calls.values())),
+                     str(result['peak_threads']) if result['peak_threads'] is not None else '-',
+                     ', '.join('{0} x{1}'.format(method, count) for method, count in top),
+                     result['error'] or ''))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]) - 1)]
+    lines = []
+    for row in rows:
+        lines.append('  '.join([row[0].ljust(widths[0]), row[1].ljust(widths[1])] +
+                               [cell.rjust(width) for cell, width in zip(row[2:5], widths[2:5])] +
+                               [row[5].ljust(widths[5]), row[6]]).rstrip())
+    return '\n'.join(lines)
+
+
+def parse_global_inputs(values):
+    global_inputs = {}
+    for value in values or []:
+        input_name, separator, input_value = value.partition('=')
+        if not separator:
+            raise argparse.ArgumentTypeError('Global input must be NAME=VALUE: ' + value)
+        global_inputs[input_name] = input_value
+    return global_inputs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the IntlTAC environment setup and teardown offline')
+    parser.add_argument('-s', '--scenario', action='append', choices=[name for name, _ in SCENARIOS],
+                        help='Scenario to run, can be repeated, all scenarios by default')
+    parser.add_argument('-l', '--list', action='store_true', help='List the scenarios and exit')
+    parser.add_argument('-g', '--global-input', action='append', metavar='NAME=VALUE',
+                        help='Reservation global input added to every scenario, e.g. quali_tracing=DIR')
+    parser.add_argument('--json', metavar='PATH', help='Also write the results, with all API call counts, to PATH')
+    parser.add_argument('--python', default=sys.executable,
+                        help='Python 2 interpreter running the scripts, defaults to the current one')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the logs of the scripts')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary directory of every scenario')
+    parser.add_argument('--run-script', choices=sorted(SCRIPT_PACKAGES), help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    scenarios = dict(SCENARIOS)
+    global_inputs = parse_global_inputs(args.global_input)
+
+    if args.run_script:
+        import logging
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+        result = run_script(args.run_script, scenarios[args.scenario[0]], args.work_dir, global_inputs)
+        sys.stdout.write(RESULT_PREFIX + json.dumps(result) + '\n')
+        return
+
+    if args.list:
+        for name, scenario in SCENARIOS:
+            print '{0:<16}{1}'.format(name, scenario['description'])
+        return
+
+    results = []
+    for name in args.scenario or [name for name, _ in SCENARIOS]:
+        sys.stderr.write('Running {0}: {1}\n'.format(name, scenarios[name]['description']))
+        scenario_results = run_scenario(args.python, name, args.verbose, args.keep, global_inputs)
+        for script in ('setup', 'teardown'):
+            results.append((name, script, scenario_results[script]))
+
+    print format_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump([dict(result, scenario=name, script=script) for name, script, result in results], json_file,
+                      indent=2, sort_keys=True)
+
+    if any(result['error'] for _, _, result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
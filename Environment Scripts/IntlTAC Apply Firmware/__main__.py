@@ -0,0 +1,9 @@
+from sandbox_scripts.environment.apply_firmware.apply_firmware_script import EnvironmentApplyFirmware
+
+
+def main():
+    EnvironmentApplyFirmware().execute()
+
+
+if __name__ == "__main__":
+    main()
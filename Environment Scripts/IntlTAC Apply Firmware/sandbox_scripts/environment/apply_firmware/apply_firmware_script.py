@@ -0,0 +1,148 @@
+import ftplib
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+from cloudshell.helpers.scripts import cloudshell_scripts_helpers as helpers
+from cloudshell.api.cloudshell_api import InputNameValue
+from cloudshell.core.logger import qs_logger
+
+from sandbox_scripts.helpers.command_dispatcher import CommandDispatcher
+from sandbox_scripts.helpers.command_tracker import CommandTracker
+from sandbox_scripts.helpers.firmware_index import FirmwareIndexCache, get_running_version, is_same_version
+from sandbox_scripts.helpers.reservation_catalog import ReservationCatalog
+from sandbox_scripts.helpers.reservation_output import ReservationOutput
+from sandbox_scripts.profiler.env_profiler import profileit
+
+
+class EnvironmentApplyFirmware(object):
+    """
+    Loads the firmware version given by the 'Version' command input on every resource of the reservation that
+    supports load_firmware, all devices at the same time, and prints the outcome of every device
+    """
+
+    def __init__(self):
+        self.reservation_id = helpers.get_reservation_context_details().id
+        self.logger = qs_logger.get_qs_logger(log_file_prefix="CloudShell Sandbox ApplyFirmware",
+                                              log_group=self.reservation_id,
+                                              log_category='ApplyFirmware')
+
+    @profileit(scriptName='ApplyFirmware')
+    def execute(self):
+        version = os.environ['Version']
+        api = helpers.get_api_session()
+        self.output = ReservationOutput(api, self.reservation_id, self.logger)
+        try:
+            catalog = ReservationCatalog(api, self.reservation_id, self.logger)
+            catalog.refresh()
+            remote_host, version_lookup = self._read_firmware_index(catalog)
+
+            results = []
+            devices = []
+            for resource in catalog.root_resources():
+                if resource.ResourceModelName.lower() == ReservationCatalog.TFTP_SERVER_MODEL:
+                    continue
+                try:
+                    if catalog.has_command(resource.Name, 'load_firmware'):
+                        devices.append(resource.Name)
+                except Exception as exc:
+                    self.logger.error('Unable to read the commands of {0}. Error: {1}'.format(resource.Name,
+                                                                                          str(exc)))
+                    results.append((resource.Name, None, 'Error: ' + self._error_message(exc), 0))
+
+            self.output.write('Loading firmware version {0} on {1} devices'.format(version, len(devices)))
+
+            # every device waits for its own load_firmware, so all devices load at the same time
+            dispatcher = CommandDispatcher(api, self.reservation_id, self.logger)
+            tracker = CommandTracker(api, self.logger)
+            if devices:
+                pool = ThreadPool(len(devices))
+                async_results = [pool.apply_async(self._apply_firmware,
+                                                  (catalog, dispatcher, tracker, remote_host, version,
+                                                   version_lookup, resource_name))
+                                 for resource_name in devices]
+                pool.close()
+                pool.join()
+                results.extend(async_result.get() for async_result in async_results)
+            self.logger.info(dispatcher.summary())
+
+            self._print_results(results)
+        finally:
+            self.output.close()
+
+    def _read_firmware_index(self, catalog):
+        """
+        :param ReservationCatalog catalog:
+        :return: address of the FTP server, and model -> version -> image path from its version_index.txt
+        :rtype: (str, dict)
+        """
+        ftp_host, user, password = catalog.get_ftp()
+        try:
+            ftp = ftplib.FTP(ftp_host)
+            ftp.login(user, password)
+            try:
+                version_lookup, bad_lines = FirmwareIndexCache(self.logger).get(ftp, ftp_host)
+            finally:
+                ftp.close()
+        except Exception as exc:
+            self.output.write('Unable to retrieve list of images from FTP. Error: {0}'.format(str(exc)))
+            raise
+
+        for line_number, line in bad_lines:
+            self.logger.error('Incorrect line format in version_index.txt, line {0}: {1}'.format(line_number, line))
+        if bad_lines:
+            self.output.write('Skipped malformed lines in version_index.txt: {0}'
+                              .format(', '.join(str(line_number) for line_number, _ in bad_lines)))
+        return ftp_host, version_lookup
+
+    def _apply_firmware(self, catalog, dispatcher, tracker, remote_host, version, version_lookup, resource_name):
+        """
+        :param ReservationCatalog catalog:
+        :param CommandDispatcher dispatcher:
+        :param CommandTracker tracker:
+        :param str remote_host:
+        :param str version:
+        :param dict version_lookup:
+        :param str resource_name:
+        :return: resource name, model, outcome, seconds
+        :rtype: tuple
+        """
+        model = None
+        try:
+            model = catalog.get_attribute(resource_name, 'Model')
+            if version not in version_lookup.get(model, {}):
+                return resource_name, model, 'No image for version ' + version, 0
+            running_version = get_running_version(catalog, resource_name)
+            if is_same_version(running_version, version):
+                return resource_name, model, 'Already running ' + running_version, 0
+
+            command_inputs = [InputNameValue('file_path', version_lookup[model][version]),
+                              InputNameValue('remote_host', remote_host)]
+            started = time.time()
+            dispatcher.enqueue(resource_name, 'load_firmware', command_inputs)
+            result = tracker.wait(resource_name, started)
+        except Exception as exc:
+            self.logger.error('Error loading firmware on {0}. Error: {1}'.format(resource_name, str(exc)))
+            return resource_name, model, 'Error: ' + self._error_message(exc), 0
+
+        if result.timed_out:
+            return resource_name, model, 'Timed out', result.duration
+        self.output.write('Loading firmware complete on ' + resource_name + '\n-- Status: ' + result.status)
+        return resource_name, model, '{0}: {1}'.format(result.status, result.description), result.duration
+
+    @staticmethod
+    def _error_message(exc):
+        return getattr(exc, 'message', '') or str(exc)
+
+    @staticmethod
+    def _print_results(results):
+        """
+        :param list results: (resource name, model, outcome, seconds) of every device
+        """
+        name_width = max([len('Resource')] + [len(result[0]) for result in results])
+        model_width = max([len('Model')] + [len(result[1] or '') for result in results])
+        print '\n{0}  {1}  {2:>6}  {3}'.format('Resource'.ljust(name_width), 'Model'.ljust(model_width), 'Time',
+                                              'Outcome')
+        for resource_name, model, outcome, duration in sorted(results):
+            print '{0}  {1}  {2:>5.0f}s  {3}'.format(resource_name.ljust(name_width), (model or '').ljust(model_width),
+                                                    duration, outcome)
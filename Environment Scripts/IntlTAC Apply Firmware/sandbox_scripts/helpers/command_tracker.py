@@ -0,0 +1,97 @@
+import time
+
+from sandbox_scripts.profiler.tracer import span
+
+
+class CommandResult(object):
+    def __init__(self, resource_name, status, description, duration, timed_out):
+        """
+        :param str resource_name:
+        :param str status: last live status name seen on the resource
+        :param str description: last live status description seen on the resource
+        :param float duration: seconds from the start of tracking until completion (or timeout)
+        :param bool timed_out:
+        """
+        self.resource_name = resource_name
+        self.status = status
+        self.description = description
+        self.duration = duration
+        self.timed_out = timed_out
+
+
+class CommandTracker(object):
+    """
+    Waits for long-running enqueued commands (load_firmware, reset, ...) by polling the live status of the
+    resource from the thread waiting for it, so every resource is polled on its own schedule. A resource is
+    considered busy while its live status is RUNNING_STATUS.
+    """
+    RUNNING_STATUS = 'Progress 10'
+
+    def __init__(self, api, logger, start_window=30, min_interval=2, max_interval=10, backoff=1.5,
+                 timeout=1230):
+        """
+        :param CloudShellAPISession api:
+        :param logger:
+        :param start_window: seconds during which a non-running status means the command did not start yet
+        :param min_interval: first poll interval of a resource, in seconds
+        :param max_interval: upper bound of the poll interval of a resource, in seconds
+        :param backoff: factor applied to the poll interval after every poll that finds the resource busy
+        :param timeout: seconds after which a resource that is still busy is reported as timed out
+        """
+        self.api = api
+        self.logger = logger
+        self.start_window = start_window
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def wait(self, resource_name, started=None, on_complete=None):
+        """
+        Polls a single resource until its command completes or times out
+        :param str resource_name:
+        :param float started: time the command was enqueued, defaults to now
+        :param on_complete: optional callable receiving the CommandResult
+        :rtype: CommandResult
+        """
+        if started is None:
+            started = time.time()
+
+        with span('wait ' + resource_name, 'device'):
+            result = self._poll(resource_name, started)
+        if on_complete is not None:
+            on_complete(result)
+        return result
+
+    def _poll(self, resource_name, started):
+        interval = self.min_interval
+        seen_running = False
+        status = None
+        description = None
+        timed_out = False
+
+        while True:
+            try:
+                live_status = self.api.GetResourceLiveStatus(resource_name)
+                status = live_status.liveStatusName
+                description = live_status.liveStatusDescription
+            except Exception as exc:
+                self.logger.warning("Error getting live status of {0}. Error: {1}".format(resource_name, str(exc)))
+                live_status = None
+
+            elapsed = time.time() - started
+            if live_status is not None:
+                if status == CommandTracker.RUNNING_STATUS:
+                    seen_running = True
+                elif seen_running or elapsed >= self.start_window:
+                    break
+
+            if elapsed >= self.timeout:
+                timed_out = True
+                break
+
+            time.sleep(interval)
+            if seen_running:
+                interval = min(interval * self.backoff, self.max_interval)
+
+        return CommandResult(resource_name, status, description, time.time() - started, timed_out)
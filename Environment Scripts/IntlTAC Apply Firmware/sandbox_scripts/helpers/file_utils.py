@@ -0,0 +1,71 @@
+import errno
+import os
+import time
+
+
+class FileLock(object):
+    """
+    Cross-process lock based on exclusive creation of a lock file. A lock older than stale_after seconds is
+    considered abandoned by a crashed process and is broken.
+    """
+
+    def __init__(self, path, timeout=30, stale_after=120):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self._fd = None
+
+    def __enter__(self):
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                self._fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_RDWR)
+                return self
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            try:
+                if time.time() - os.path.getmtime(self.path) > self.stale_after:
+                    os.remove(self.path)
+                    continue
+            except OSError:
+                continue
+            if time.time() > deadline:
+                raise IOError('Timed out waiting for lock ' + self.path)
+            time.sleep(0.1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        os.close(self._fd)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def make_dirs(directory):
+    """
+    Creates directory and its parents unless they exist, also when another process creates them concurrently
+    :param str directory:
+    """
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+
+def atomic_write(path, write):
+    """
+    Replaces the file at path with a temporary file written next to it, readers never see a partial file.
+    The directory of path is created if needed.
+    :param str path:
+    :param write: callable receiving the temporary file open for writing
+    """
+    make_dirs(os.path.dirname(path))
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'w') as temp_file:
+        write(temp_file)
+    if os.path.exists(path):
+        os.remove(path)  # os.rename does not overwrite on Windows
+    os.rename(temp_path, path)
@@ -0,0 +1,171 @@
+import json
+import os
+import tempfile
+
+from sandbox_scripts.helpers.file_utils import FileLock, atomic_write, make_dirs
+
+VERSION_INDEX_FILE = 'version_index.txt'
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'gigamon_cache')
+# attributes the GigaVue shells populate with the running software version during autoload
+VERSION_ATTRIBUTES = ['OS Version', 'Software Version', 'Firmware Version']
+
+
+class VersionIndexParser(object):
+    """
+    Single pass parser of version_index.txt, fed with the raw blocks returned by retrbinary. Lines may end with
+    '\r', '\n' or '\r\n' and may be split across blocks; only the current partial line is kept in memory.
+    Malformed lines are collected in bad_lines instead of aborting the parse.
+    """
+    BOM = '\xef\xbb\xbf'
+
+    def __init__(self):
+        self.version_lookup = {}
+        self.bad_lines = []
+        self._pending = ''
+        self._line_number = 0
+
+    def feed(self, chunk):
+        """
+        :param str chunk: next block of the file
+        """
+        data = self._pending + chunk
+        keep = ''
+        if data.endswith('\r'):  # may be the first half of '\r\n'
+            data, keep = data[:-1], '\r'
+        lines = data.splitlines(True)
+        if lines and not lines[-1].endswith(('\r', '\n')):
+            keep = lines.pop() + keep
+        self._pending = keep
+
+        for line in lines:
+            self._parse_line(line)
+
+    def close(self):
+        """
+        Parses the last line if the file does not end with a line break
+        :return: model -> version -> image path
+        :rtype: dict
+        """
+        if self._pending:
+            self._parse_line(self._pending)
+            self._pending = ''
+        return self.version_lookup
+
+    def _parse_line(self, line):
+        self._line_number += 1
+        if self._line_number == 1 and line.startswith(VersionIndexParser.BOM):
+            line = line[len(VersionIndexParser.BOM):]
+        line = line.strip()
+        if not line:
+            return
+
+        fields = [field.strip() for field in line.split(',')]
+        if len(fields) != 3 or not all(fields):
+            self.bad_lines.append((self._line_number, line))
+            return
+
+        model, version_string, path = fields
+        if model not in self.version_lookup:
+            self.version_lookup[model] = {}
+        self.version_lookup[model][version_string] = path
+
+
+def get_running_version(catalog, resource_name):
+    """
+    :param ReservationCatalog catalog:
+    :param str resource_name:
+    :return: the software version the device reported on its last autoload, None if unknown
+    :rtype: str
+    """
+    for attribute_name in VERSION_ATTRIBUTES:
+        value = catalog.get_attribute(resource_name, attribute_name)
+        if value:
+            return value.strip()
+    return None
+
+
+def is_same_version(current_version, requested_version):
+    """
+    Versions are equal up to trailing zero parts, e.g. '4.7' matches '4.7.00' but not '4.7.1'
+    :param str current_version:
+    :param str requested_version:
+    :rtype: bool
+    """
+    if not current_version:
+        return False
+    return _normalize_version(current_version) == _normalize_version(requested_version)
+
+
+def _normalize_version(version):
+    """
+    :param str version: e.g. 'v4.7.00'
+    :return: version parts without the trailing zero parts, numbers as int, e.g. [4, 7]
+    :rtype: list
+    """
+    parts = [int(part) if part.isdigit() else part for part in version.strip().lower().lstrip('v').split('.')]
+    while len(parts) > 1 and parts[-1] == 0:
+        parts.pop()
+    return parts
+
+
+class FirmwareIndexCache(object):
+    """
+    On-disk cache of the parsed version_index.txt of an FTP server, shared by all the scripts running on the
+    execution server. The cached index is used as long as the MDTM and SIZE of the remote file are unchanged.
+    """
+
+    def __init__(self, logger, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        :param logger:
+        :param str cache_dir:
+        """
+        self.logger = logger
+        self.cache_dir = cache_dir
+
+    def get(self, ftp, ftp_host):
+        """
+        :param ftplib.FTP ftp: logged in FTP connection
+        :param str ftp_host: used to key the cache
+        :return: model -> version -> image path, and the (line number, line) of every malformed line
+        :rtype: (dict, list)
+        """
+        cache_path = os.path.join(self.cache_dir, 'version_index_{0}.json'.format(ftp_host))
+        stamp = self._remote_stamp(ftp)
+
+        if stamp is not None:
+            cached = self._read(cache_path)
+            if cached is not None and cached.get('stamp') == stamp:
+                self.logger.debug('Using cached {0} from {1}'.format(VERSION_INDEX_FILE, cache_path))
+                return cached['index'], [tuple(bad_line) for bad_line in cached.get('bad_lines', [])]
+
+        parser = VersionIndexParser()
+        ftp.retrbinary('retr ' + VERSION_INDEX_FILE, parser.feed)
+        version_lookup = parser.close()
+
+        if stamp is not None:
+            try:
+                self._write(cache_path, {'stamp': stamp, 'index': version_lookup, 'bad_lines': parser.bad_lines})
+            except Exception as exc:
+                self.logger.warning('Unable to cache {0}. Error: {1}'.format(VERSION_INDEX_FILE, str(exc)))
+        return version_lookup, parser.bad_lines
+
+    def _remote_stamp(self, ftp):
+        try:
+            return [ftp.sendcmd('MDTM ' + VERSION_INDEX_FILE).split()[-1], ftp.size(VERSION_INDEX_FILE)]
+        except Exception as exc:
+            self.logger.debug('Unable to read MDTM/SIZE of {0}, cache disabled. Error: {1}'
+                              .format(VERSION_INDEX_FILE, str(exc)))
+            return None
+
+    @staticmethod
+    def _read(cache_path):
+        try:
+            with open(cache_path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+
+    def _write(self, cache_path, content):
+        make_dirs(self.cache_dir)
+        with FileLock(cache_path + '.lock'):
+            atomic_write(cache_path, lambda cache_file: json.dump(content, cache_file))
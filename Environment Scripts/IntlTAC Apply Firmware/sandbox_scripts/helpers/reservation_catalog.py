@@ -0,0 +1,140 @@
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+
+class ReservationCatalog(object):
+    """
+    Reservation-scoped cache of resource details, attributes and commands. Root resources (resources whose
+    FullAddress has no '/') are fetched once, concurrently, when the catalog is refreshed; everything else is
+    fetched on first use.
+    """
+    TFTP_SERVER_MODEL = 'generic tftp server'
+
+    def __init__(self, api, reservation_id, logger, max_workers=16):
+        """
+        :param CloudShellAPISession api:
+        :param str reservation_id:
+        :param logger:
+        :param max_workers: maximum number of resources fetched at the same time
+        """
+        self.api = api
+        self.reservation_id = reservation_id
+        self.logger = logger
+        self.max_workers = max_workers
+        self.reservation_details = None
+        self._details = {}
+        self._commands = {}
+        self._lock = Lock()
+
+    def refresh(self, reservation_details=None):
+        """
+        Reads the reservation and prefetches the root resources that are not in the catalog yet
+        :param GetReservationDescriptionResponseInfo reservation_details: already fetched reservation details
+        :rtype: GetReservationDescriptionResponseInfo
+        """
+        if reservation_details is None:
+            reservation_details = self.api.GetReservationDetails(self.reservation_id)
+        self.reservation_details = reservation_details
+
+        with self._lock:
+            missing = [resource.Name for resource in self.root_resources() if resource.Name not in self._details]
+        if missing:
+            self.logger.debug("Prefetching details and commands of {0} resources".format(len(missing)))
+            pool = ThreadPool(min(len(missing), self.max_workers))
+            pool.map(self._prefetch, missing)
+            pool.close()
+            pool.join()
+
+        return reservation_details
+
+    def root_resources(self):
+        """
+        :rtype: list[ReservedResourceInfo]
+        """
+        return [resource for resource in self.reservation_details.ReservationDescription.Resources
+                if '/' not in resource.FullAddress]
+
+    def get_details(self, resource_name):
+        """
+        :param str resource_name:
+        :rtype: ResourceInfo
+        """
+        with self._lock:
+            if resource_name in self._details:
+                return self._details[resource_name]
+        resource_details = self.api.GetResourceDetails(resource_name)
+        self.set_details(resource_name, resource_details)
+        return resource_details
+
+    def set_details(self, resource_name, resource_details):
+        """
+        :param str resource_name:
+        :param ResourceInfo resource_details:
+        """
+        with self._lock:
+            self._details[resource_name] = resource_details
+
+    def invalidate(self, resource_name):
+        """
+        Drops the cached details of a resource, e.g. after its structure changed by autoload
+        :param str resource_name:
+        """
+        with self._lock:
+            self._details.pop(resource_name, None)
+
+    def get_attribute(self, resource_name, attribute_name, default=None):
+        """
+        :param str resource_name:
+        :param str attribute_name:
+        :param default: value returned when the resource has no such attribute
+        :rtype: str
+        """
+        for attribute in self.get_details(resource_name).ResourceAttributes:
+            if attribute.Name == attribute_name:
+                return attribute.Value
+        return default
+
+    def get_commands(self, resource_name):
+        """
+        :param str resource_name:
+        :return: names of the resource commands
+        :rtype: list[str]
+        """
+        with self._lock:
+            if resource_name in self._commands:
+                return self._commands[resource_name]
+        commands = [command.Name for command in self.api.GetResourceCommands(resource_name).Commands]
+        with self._lock:
+            self._commands[resource_name] = commands
+        return commands
+
+    def has_command(self, resource_name, command_name):
+        """
+        :param str resource_name:
+        :param str command_name:
+        :rtype: bool
+        """
+        return command_name in self.get_commands(resource_name)
+
+    def get_ftp(self):
+        """
+        :return: address, storage username and storage password of the reservation's TFTP server
+        :rtype: tuple
+        """
+        server = None
+        user = None
+        password = None
+        for resource in self.reservation_details.ReservationDescription.Resources:
+            if resource.ResourceModelName.lower() == ReservationCatalog.TFTP_SERVER_MODEL:
+                server = resource.FullAddress
+                user = self.get_attribute(resource.Name, 'Storage username')
+                password = self.get_attribute(resource.Name, 'Storage password')
+
+        return server, user, password
+
+    def _prefetch(self, resource_name):
+        try:
+            self.get_details(resource_name)
+            self.get_commands(resource_name)
+        except Exception as exc:
+            self.logger.warning("Error prefetching resource {0}. Error: {1}".format(resource_name, str(exc)))
@@ -0,0 +1,96 @@
+import time
+from Queue import Queue, Empty
+from threading import Event, Thread
+
+
+class _FlushRequest(object):
+    def __init__(self):
+        self.done = Event()
+
+
+class ReservationOutput(object):
+    """
+    Asynchronous sink for reservation output messages. Messages are queued by any thread and written in order by
+    a background thread; messages queued close together are merged into a single WriteMessageToReservationOutput
+    call, one message per line.
+    """
+
+    def __init__(self, api, reservation_id, logger, linger=0.2, max_batch=50):
+        """
+        :param CloudShellAPISession api:
+        :param str reservation_id:
+        :param logger:
+        :param linger: seconds to wait for more messages before writing a batch
+        :param max_batch: maximum number of messages merged into one call
+        """
+        self.api = api
+        self.reservation_id = reservation_id
+        self.logger = logger
+        self.linger = linger
+        self.max_batch = max_batch
+        self._queue = Queue()
+        self._closed = False
+        self._thread = Thread(target=self._run, name='ReservationOutput')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, message):
+        """
+        Queues a message, the lines of one message are never interleaved with those of other threads, so related
+        lines written from concurrent threads belong in a single message
+        :param str message: one or more lines
+        """
+        self._queue.put(message)
+
+    def flush(self):
+        """
+        Blocks until every message written so far reached the reservation output
+        """
+        if self._closed:
+            return
+        request = _FlushRequest()
+        self._queue.put(request)
+        request.done.wait()
+
+    def close(self):
+        """
+        Flushes the pending messages and stops the background thread
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = []
+            item = self._queue.get()
+            deadline = time.time() + self.linger
+            while True:
+                if item is None or isinstance(item, _FlushRequest):
+                    self._send(batch)
+                    batch = []
+                    if item is None:
+                        return
+                    item.done.set()
+                else:
+                    batch.append(item)
+                    if len(batch) >= self.max_batch:
+                        self._send(batch)
+                        batch = []
+
+                remaining = deadline - time.time()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, batch):
+        if not batch:
+            return
+        try:
+            self.api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message='\n'.join(batch))
+        except Exception as exc:
+            self.logger.warning("Error writing to reservation output. Error: {0}".format(str(exc)))
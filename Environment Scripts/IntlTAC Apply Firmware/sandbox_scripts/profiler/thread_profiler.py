@@ -0,0 +1,136 @@
+import cProfile
+import ctypes
+import ctypes.util
+import os
+import threading
+import time
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+class _FileTime(ctypes.Structure):
+    _fields_ = [('dwLowDateTime', ctypes.c_uint32), ('dwHighDateTime', ctypes.c_uint32)]
+
+
+def _load_thread_cpu_time():
+    """
+    :return: function returning the CPU seconds used by the calling thread, None if the platform has none
+    """
+    try:
+        if os.name == 'nt':
+            kernel32 = ctypes.windll.kernel32
+
+            def windows_thread_cpu_time():
+                creation, exited, kernel, user = _FileTime(), _FileTime(), _FileTime(), _FileTime()
+                kernel32.GetThreadTimes(kernel32.GetCurrentThread(), ctypes.byref(creation), ctypes.byref(exited),
+                                        ctypes.byref(kernel), ctypes.byref(user))
+                ticks = sum((filetime.dwHighDateTime << 32) + filetime.dwLowDateTime for filetime in (kernel, user))
+                return ticks / 10000000.0
+            return windows_thread_cpu_time
+
+        clock_thread_cputime_id = 3
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+        def posix_thread_cpu_time():
+            timespec = _Timespec()
+            if clock_gettime(clock_thread_cputime_id, ctypes.byref(timespec)) != 0:
+                return None
+            return timespec.tv_sec + timespec.tv_nsec / 1000000000.0
+        posix_thread_cpu_time()
+        return posix_thread_cpu_time
+    except Exception:
+        return lambda: None
+
+thread_cpu_time = _load_thread_cpu_time()
+
+
+class ThreadRecord(object):
+    def __init__(self, name, profile, wall, cpu):
+        """
+        :param str name: thread name
+        :param cProfile.Profile profile: profile of everything the thread ran
+        :param float wall: seconds the thread ran
+        :param float cpu: CPU seconds used by the thread, None when unknown
+        """
+        self.name = name
+        self.profile = profile
+        self.wall = wall
+        self.cpu = cpu
+
+
+class ThreadProfiler(object):
+    """
+    Profiles every thread started while it is active (ThreadPool workers, task threads, ...), each with its own
+    cProfile.Profile, by replacing threading.Thread.run
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+        self._original_run = None
+
+    def start(self):
+        self._original_run = original_run = threading.Thread.run
+        profiler = self
+
+        def profiled_run(thread):
+            profile = cProfile.Profile()
+            started = time.time()
+            cpu_started = thread_cpu_time()
+            try:
+                profile.runcall(original_run, thread)
+            finally:
+                cpu_ended = thread_cpu_time()
+                cpu = cpu_ended - cpu_started if cpu_started is not None and cpu_ended is not None else None
+                profiler.add(ThreadRecord(thread.name, profile, time.time() - started, cpu))
+
+        threading.Thread.run = profiled_run
+
+    def stop(self):
+        if self._original_run is not None:
+            threading.Thread.run = self._original_run
+            self._original_run = None
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def profile_call(self, func, *args, **kwargs):
+        """
+        Runs func in the calling thread under its own profile, recorded with the other threads
+        """
+        profile = cProfile.Profile()
+        started = time.time()
+        cpu_started = thread_cpu_time()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            cpu_ended = thread_cpu_time()
+            cpu = cpu_ended - cpu_started if cpu_started is not None and cpu_ended is not None else None
+            self.add(ThreadRecord(threading.current_thread().name, profile, time.time() - started, cpu))
+
+    def print_breakdown(self, stream):
+        """
+        Writes the wall clock and CPU time of every profiled thread, longest first
+        """
+        with self._lock:
+            records = sorted(self.records, key=lambda record: record.wall, reverse=True)
+        name_width = max([len('Thread')] + [len(record.name) for record in records])
+        stream.write('{0}  {1:>10}  {2:>10}  {3:>6}\n'.format('Thread'.ljust(name_width), 'Wall (s)', 'CPU (s)',
+                                                             'CPU %'))
+        for record in records:
+            if record.cpu is None:
+                stream.write('{0}  {1:>10.3f}  {2:>10}  {3:>6}\n'.format(record.name.ljust(name_width), record.wall,
+                                                                        'n/a', 'n/a'))
+            else:
+                stream.write('{0}  {1:>10.3f}  {2:>10.3f}  {3:>5.1f}%\n'.format(
+                    record.name.ljust(name_width), record.wall, record.cpu,
+                    100.0 * record.cpu / record.wall if record.wall else 0))
+        stream.write('\n{0} threads, {1:.3f}s wall, {2}s CPU\n\n'.format(
+            len(records), sum(record.wall for record in records),
+            '{0:.3f}'.format(sum(record.cpu for record in records))
+            if all(record.cpu is not None for record in records) else 'n/a'))
@@ -1,4 +1,3 @@
-from multiprocessing.pool import ThreadPool
 from threading import Lock
 
 from cloudshell.helpers.scripts import cloudshell_scripts_helpers as helpers
@@ -7,9 +6,19 @@ from cloudshell.api.common_cloudshell_api import CloudShellAPIError
 from cloudshell.core.logger import qs_logger
 
 from sandbox_scripts.helpers.vm_details_helper import get_vm_custom_param, get_vm_details
+from sandbox_scripts.helpers.command_dispatcher import CommandDispatcher
+from sandbox_scripts.helpers.command_tracker import CommandTracker
+from sandbox_scripts.helpers.config_baseline import ConfigBaseline
+from sandbox_scripts.helpers.firmware_index import FirmwareIndexCache, get_running_version, is_same_version
+from sandbox_scripts.helpers.instrumented_api import InstrumentedApiSession
+from sandbox_scripts.helpers.operation_executor import OperationExecutor
+from sandbox_scripts.helpers.reservation_catalog import ReservationCatalog
+from sandbox_scripts.helpers.reservation_output import ReservationOutput
+from sandbox_scripts.helpers.task_graph import TaskGraph
 from sandbox_scripts.profiler.env_profiler import profileit
-import time
 import ftplib
+import os
+import time
 
 class EnvironmentSetup(object):
     NO_DRIVER_ERR = "129"
@@ -19,292 +28,357 @@ class EnvironmentSetup(object):
     # HC_GigaVueVersions={'4.5':'hc2_2016-03-04_gm.img','4.6':'hc2_2016-05-19.img','4.7':'hc2_2016-09-08_gm.img'}
 
 
-    def _get_ftp(self, api, reservationId):
-        """
-
-        :type api: CloudShellAPISession
-        :type reservation:  ReservationContextDetails
-        :return:
-        """
-        resv_det = api.GetReservationDetails(reservationId)
-
-        server = None
-        user = None
-        password = None
-        for resource in resv_det.ReservationDescription.Resources:
-            if resource.ResourceModelName.lower() == 'generic tftp server':
-                server = resource.FullAddress
-                res_det = api.GetResourceDetails(resource.Name)
-                for attribute in res_det.ResourceAttributes:
-                    if attribute.Name == 'Storage username':
-                        user = attribute.Value
-                    if attribute.Name == 'Storage password':
-                        password = attribute.Value
-
-        return server, user, password
-
     def __init__(self):
         self.reservation_id = helpers.get_reservation_context_details().id
         self.logger = qs_logger.get_qs_logger(log_file_prefix="CloudShell Sandbox Setup",
                                               log_group=self.reservation_id,
                                               log_category='Setup')
+        self.executor = OperationExecutor.from_global_inputs(
+            self.logger, helpers.get_reservation_context_details().parameters.global_inputs)
 
     @profileit(scriptName='Setup')
     def execute(self):
-        api = helpers.get_api_session()
-        resource_details_cache = {}
-
-        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                            message='Beginning reservation setup')
+        api = InstrumentedApiSession(helpers.get_api_session())
+        self.output = ReservationOutput(api, self.reservation_id, self.logger)
+        try:
+            catalog = ReservationCatalog(api, self.reservation_id, self.logger)
+
+            self.output.write('Beginning reservation setup')
+
+            reservation_details = catalog.refresh()
+
+            global_inputs = helpers.get_reservation_context_details().parameters.global_inputs
+
+            self.output.write(str(global_inputs))
+
+            # Each resource moves through its own steps, a step only waits for the steps it depends on
+            graph = TaskGraph(self.logger)
+            firmware_load = {
+                "version": global_inputs.get('GigaVue Version'),
+                "timed_out": [],
+                "skipped": [],
+                "durations": []
+            }
+
+            graph.add('deploy', self._deploy_and_schedule_apps,
+                      (api, graph, catalog, reservation_details, firmware_load))
+
+            # Begin Firmware load for IntlTAC environments
+            #############################################
+
+            # Check for presense of version selector input. Physical devices only need the FTP server, so their
+            # firmware load overlaps with app deployment and IP refresh
+            if firmware_load['version']:
+                self.logger.info("Executing load_firmware for relevant devices: version " + firmware_load['version'])
+                self.output.write('Beginning load_firmware')
+                graph.add('firmware_index', self._read_firmware_index, (api, catalog, firmware_load))
+                for resource in catalog.root_resources():
+                    if catalog.has_command(resource.Name, 'load_firmware'):
+                        graph.add('firmware:' + resource.Name, self._load_firmware,
+                                  (api, catalog, firmware_load, resource.Name), depends_on=['firmware_index'])
+
+            graph.run()
+            self.output.flush()
+
+            self.logger.info(self.executor.summary())
+            if 'dispatcher' in firmware_load:
+                self.logger.info(firmware_load['dispatcher'].summary())
+            self._report_skipped_firmware_loads(firmware_load)
+            timed_out = firmware_load['timed_out']
+            if timed_out:
+                self.logger.error("At least one resource did not complete load_firmware: " + ','.join(timed_out))
+                self.output.write('The following resources failed to complete load_firmware: ' + ','.join(timed_out))
+
+            failures = graph.failures()
+            if failures:
+                raise failures[0].error
+
+            # a device still loading its firmware has no stable config, teardown resets all devices then
+            if not timed_out:
+                self._capture_config_baseline(api, catalog)
+
+            self.logger.info("Setup for reservation {0} completed".format(self.reservation_id))
+
+            self.output.write('Reservation setup finished successfully')
+        finally:
+            self.output.close()
+            self._report_api_usage(api)
+
+    def _report_api_usage(self, api):
+        """
+        Logs the API calls made by the setup, and saves them to the 'quali_api_stats' directory when set
+        :param InstrumentedApiSession api:
+        :return:
+        """
+        self.logger.info('API calls of reservation setup:\n' + api.summary())
+        reservation_context = helpers.get_reservation_context_details()
+        api_stats_dir = reservation_context.parameters.global_inputs.get('quali_api_stats')
+        if not api_stats_dir:
+            return
+        try:
+            api.write_json(os.path.join(api_stats_dir, 'Setup_{0}_{1}.api.json'.format(
+                reservation_context.environment_name, self.reservation_id)))
+        except Exception as exc:
+            self.logger.warning('Unable to save API call statistics. Error: {0}'.format(str(exc)))
 
-        reservation_details = api.GetReservationDetails(self.reservation_id)
+    def _capture_config_baseline(self, api, catalog):
+        """
+        Fingerprints the running config of every device, teardown skips the factory reset of the devices whose
+        config is unchanged
+        :param CloudShellAPISession api:
+        :param ReservationCatalog catalog:
+        :return:
+        """
+        resource_names = [resource.Name for resource in catalog.root_resources()
+                          if catalog.has_command(resource.Name, ConfigBaseline.FINGERPRINT_COMMAND)]
+        if not resource_names:
+            return
+        baseline = ConfigBaseline(api, self.reservation_id, self.logger).capture(resource_names)
+        self.logger.info('Saved config baseline of {0} of {1} devices'.format(len(baseline), len(resource_names)))
 
+    def _deploy_and_schedule_apps(self, api, graph, catalog, reservation_details, firmware_load):
+        """
+        Deploys the apps, then adds the connect, power on/refresh IP/install, autoload and firmware steps of
+        every resource to the graph
+        :param CloudShellAPISession api:
+        :param TaskGraph graph:
+        :param ReservationCatalog catalog:
+        :param GetReservationDescriptionResponseInfo reservation_details:
+        :param dict firmware_load:
+        :return:
+        """
         deploy_result = self._deploy_apps_in_reservation(api=api,
                                                          reservation_details=reservation_details)
 
         # refresh reservation_details after app deployment if any deployed apps
         if deploy_result and deploy_result.ResultItems:
-            reservation_details = api.GetReservationDetails(self.reservation_id)
-
-        self._connect_all_routes_in_reservation(api=api,
-                                                reservation_details=reservation_details)
-
-        self._run_async_power_on_refresh_ip_install(api=api,
-                                                    reservation_details=reservation_details,
-                                                    deploy_results=deploy_result,
-                                                    resource_details_cache=resource_details_cache)
-
-        self._try_exeucte_autoload(api=api,
-                                   reservation_details=reservation_details,
-                                   deploy_result=deploy_result,
-                                   resource_details_cache=resource_details_cache)
+            reservation_details = catalog.refresh()
 
-        remote_host, user, password = self._get_ftp(api, self.reservation_id)
+        graph.add('connect_routes', self._connect_all_routes_in_reservation, (api, reservation_details))
 
-        global_inputs = helpers.get_reservation_context_details().parameters.global_inputs
-
-        api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message = str(global_inputs))
-
-        # Begin Firmware load for IntlTAC environments
-        #############################################
-
-        # Check for presense of version selector input
-        if 'GigaVue Version' in global_inputs:
-            self.logger.info("Executing load_firmware for relevant devices: version " + global_inputs['GigaVue Version'])
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message = 'Beginning load_firmware')
-            version = global_inputs['GigaVue Version']
-            self._apply_software_image(api=api,
-                                   reservation_details=reservation_details,
-                                   deploy_result=deploy_result,
-                                   resource_details_cache=resource_details_cache,
-                                       version=version,
-                                    remote_host=remote_host)
-
-        self.logger.info("Setup for reservation {0} completed".format(self.reservation_id))
+        # sub-resources (ports etc.) and physical devices have nothing to power on
+        resources = [resource for resource in catalog.root_resources() if self._may_be_deployed_app(catalog, resource)]
+        if len(resources) == 0:
+            self.output.write('No resources to power on or install')
 
+        lock = Lock()
+        message_status = {
+            "power_on": False,
+            "wait_for_ip": False,
+            "install": False,
+            "autoload": False
+        }
+        for resource in resources:
+            graph.add('power_on_refresh_ip_install:' + resource.Name, self._power_on_refresh_ip_install_or_raise,
+                      (api, lock, message_status, resource, deploy_result, catalog), depends_on=['connect_routes'])
 
-        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                            message='Reservation setup finished successfully')
+        graph.add('validate_deploy', self._validate_all_apps_deployed, (deploy_result,))
 
+        if deploy_result is None:
+            self.logger.info("No apps to discover")
+            self.output.write('No apps to discover')
+            return
 
-    def _apply_software_image(self, api, reservation_details, deploy_result, resource_details_cache, version,
-                              remote_host):
+        # every app is discovered as soon as it is up, concurrently with the others
+        for deployed_app in deploy_result.ResultItems:
+            if not deployed_app.Success:
+                continue
+            deployed_app_name = deployed_app.AppDeploymentyInfo.LogicalResourceName
+            prepare_task = 'power_on_refresh_ip_install:' + deployed_app_name
+            graph.add('autoload:' + deployed_app_name, self._try_exeucte_autoload,
+                      (api, deployed_app_name, catalog, lock, message_status),
+                      depends_on=[prepare_task] if prepare_task in graph else [])
+
+            # deployed apps get their firmware once discovered
+            if firmware_load['version'] and catalog.has_command(deployed_app_name, 'load_firmware'):
+                graph.add('firmware:' + deployed_app_name, self._load_firmware,
+                          (api, catalog, firmware_load, deployed_app_name),
+                          depends_on=['firmware_index', 'autoload:' + deployed_app_name])
+
+    def _read_firmware_index(self, api, catalog, firmware_load):
         """
-
+        Reads version_index.txt from the reservation FTP server into firmware_load
         :param CloudShellAPISession api:
-        :param GetReservationDescriptionResponseInfo reservation_details:
-        :param BulkAppDeploymentyInfo deploy_result:
-        :param resource_details_cache:
+        :param ReservationCatalog catalog:
+        :param dict firmware_load:
         :return:
         """
 
         # Reading version lookup info from FTP
-        ftp_host, user, password = self._get_ftp(api, self.reservation_id)
+        ftp_host, user, password = catalog.get_ftp()
 
+        ftp = None
         try:
             ftp = ftplib.FTP(ftp_host)  # connect to FTP
             ftp.login(user, password)
         except Exception as exc:
+            if ftp is not None:
+                ftp.close()
             self.logger.error('Unable to apply software images, unable to connect to FTP server. Error: {0}'.format(str(exc)))
+            self.output.write('Unable to apply software images, unable to connect to FTP server. Error: {0}'.format(str(exc)))
+            return
 
-
-        version_lines=[]
+        # Read version_index.txt, from the local cache unless it changed on the FTP server
         try:
-            ftp.retrbinary('retr version_index.txt',version_lines.append)  # read version_index.txt
+            version_lookup, bad_lines = FirmwareIndexCache(self.logger).get(ftp, ftp_host)
         except Exception as exc:
             self.logger.error('Unable to apply software images, unable to retrieve firmware version file. Error: {0}'.format(str(exc)))
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                                message='Unable to apply software images, unable to retrieve firmware version file Error: {0}'.format(str(exc)))
+            self.output.write('Unable to apply software images, unable to retrieve firmware version file Error: {0}'.format(str(exc)))
             return
+        finally:
+            ftp.close()
 
-        # Parse version_index.txt text into dictionary lookup
-        try:
-            version_lines=version_lines[0].split('\r')
-            version_lines=map(str.strip,version_lines)
-            version_lookup = {}
-        except:
-            self.logger.error('Unable to apply software images, unable to parse firmware version file. Error: {0}'.format(str(exc)))
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                                message='Unable to apply software images, unable to parse firmware version file Error: {0}'.format(str(exc)))
-            return
+        for line_number, line in bad_lines:
+            self.logger.error('Incorrect line format in version_index.txt, line {0}: {1}'.format(line_number, line))
+        if bad_lines:
+            self.output.write('Skipped {0} malformed lines in version_index.txt'.format(len(bad_lines)))
 
-        for line in version_lines:
-            try:
-                model,version_string,path = line.split(',')
-            except ValueError:
-                self.logger.error('Incorrect line format in version_index.txt: ' + line)
-                api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message =
-                'Unable to apply software images,configuration file format error')
-                return
-            if model not in version_lookup:
-                version_lookup[model] = {}
-            version_lookup[model][version_string] = path
-
-        running_resources = []
-        for resource in reservation_details.ReservationDescription.Resources: # go through the list of resources
-            self.logger.debug("Determining if load_firmware will run on " + resource.Name)
-            if '/' not in resource.FullAddress: # this filters out any sub-resources (sub resources have '/' in full add.
-                attributes = api.GetResourceDetails(resource.Name).ResourceAttributes
-                model=None
-                for attribute in attributes:
-                    if attribute.Name == 'Model':
-                        model = attribute.Value
-
-                command_list = api.GetResourceCommands(resource.Name).Commands
-
-                for command in command_list:
-                    if command.Name == 'load_firmware':
-                        if ftp_host is None:
-                            api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message =
-                                                                'Error loading firmware on ' + resource.Name +
-                                                                ', FTP not connected')
-                            self.logger.error('Error loading firmware on ' + resource.Name +
-                                                                ', FTP not connected')
-                            break
-                        api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message='Loading firmware on ' +
-                                                                                               resource.Name)
-                        api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message='-- ' +
-                                                                                               version_lookup[model][version])
-
-                        self.logger.info('Loading firmware on ' + resource.Name)
-                        self.logger.info(version_lookup[model][version])
-                        command_inputs = []
-                        command_inputs.append(InputNameValue('file_path', version_lookup[model][version]))
-                        command_inputs.append(InputNameValue('remote_host', remote_host))
-                        try:
-                            api.EnqueueCommand(self.reservation_id, resource.Name, 'Resource', 'load_firmware', command_inputs) # execute it
-                            running_resources.append(resource.Name)
-                            time.sleep(2)  # Workaround for 'resource temporarily unavailable' error
-                        except Exception as exc:
-                            self.logger.error("Error executing load_firmware command on resource {0}. Error: {1}"
-                                              .format(resource.Name, str(exc)))
-                            api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                                message='load_firmware failed on "{0}": {1}'
-                                                                .format(resource.Name, exc.message))
-
-                        break
-        time.sleep(30)  # Wait for command execution to start
-
-        # Wait for executions to complete
-        command_completion = False
-        loop_count = 0
-        running_resources_copy = running_resources
-        while not command_completion and loop_count < 120:
-            still_running = False
-            for resource in running_resources:
-                status = api.GetResourceLiveStatus(resource)
-
-                if status.liveStatusName == 'Progress 10':
-                    still_running = True
-                else:
-                    api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message='Loading firmware complete on ' +
-                                                                                               resource)
-                    api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message='-- Status: ' +
-                                                                                               status.liveStatusName)
-                    self.logger.info('load_firmware completed on {0}. Status: {1}:{2}'.format(resource, status.liveStatusName,
-                                                                                              status.liveStatusDescription))
-                    running_resources_copy.remove(resource)
-            if not still_running:
-                command_completion = True
-
-            loop_count += 1
-            time.sleep(10)
-
-        if not command_completion:
-            self.logger.error("At least one resource did not complete load_firmware: " + ','.join(running_resources_copy))
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message = 'The following resources failed to complete load_firmware: ' + ','.join(running_resources_copy))
-
-
-    def _try_exeucte_autoload(self, api, reservation_details, deploy_result, resource_details_cache):
+        firmware_load['remote_host'] = ftp_host
+        firmware_load['dispatcher'] = CommandDispatcher(api, self.reservation_id, self.logger)
+        firmware_load['tracker'] = CommandTracker(api, self.logger)
+        firmware_load['version_lookup'] = version_lookup
+
+    def _load_firmware(self, api, catalog, firmware_load, resource_name):
         """
-        :param GetReservationDescriptionResponseInfo reservation_details:
+        Enqueues load_firmware on a device and waits for it to complete
         :param CloudShellAPISession api:
-        :param BulkAppDeploymentyInfo deploy_result:
-        :param (dict of str: ResourceInfo) resource_details_cache:
+        :param ReservationCatalog catalog:
+        :param dict firmware_load:
+        :param str resource_name:
         :return:
         """
+        if 'version_lookup' not in firmware_load:
+            return  # version_index.txt could not be read, already reported
+
+        version = firmware_load['version']
+        version_lookup = firmware_load['version_lookup']
+        model = catalog.get_attribute(resource_name, 'Model')
+
+        if version not in version_lookup.get(model, {}):
+            self.output.write('Error loading firmware on ' + resource_name +
+                              ', no image for model {0} version {1}'.format(model, version))
+            self.logger.error('No entry in version_index.txt for model {0} version {1}, skipping {2}'
+                              .format(model, version, resource_name))
+            return
 
-        if deploy_result is None:
-            self.logger.info("No apps to discover")
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message='No apps to discover')
+        current_version = get_running_version(catalog, resource_name)
+        if is_same_version(current_version, version):
+            self.logger.info('{0} already runs version {1}, skipping load_firmware'.format(resource_name,
+                                                                                         current_version))
+            self.output.write(resource_name + ' already runs version ' + current_version + ', firmware not loaded')
+            firmware_load['skipped'].append(resource_name)
             return
 
-        message_written = False
+        self.output.write('Loading firmware on ' + resource_name + '\n-- ' + version_lookup[model][version])
 
-        for deployed_app in deploy_result.ResultItems:
-            if not deployed_app.Success:
-                continue
-            deployed_app_name = deployed_app.AppDeploymentyInfo.LogicalResourceName
+        self.logger.info('Loading firmware on ' + resource_name)
+        self.logger.info(version_lookup[model][version])
+        command_inputs = []
+        command_inputs.append(InputNameValue('file_path', version_lookup[model][version]))
+        command_inputs.append(InputNameValue('remote_host', firmware_load['remote_host']))
+        try:
+            firmware_load['dispatcher'].enqueue(resource_name, 'load_firmware', command_inputs) # execute it
+        except Exception as exc:
+            self.logger.error("Error executing load_firmware command on resource {0}. Error: {1}"
+                              .format(resource_name, str(exc)))
+            self.output.write('load_firmware failed on "{0}": {1}'.format(resource_name, exc.message))
+            return
 
-            resource_details = api.GetResourceDetails(deployed_app_name)
-            resource_details_cache[deployed_app_name] = resource_details
+        # Wait for execution to complete
+        result = firmware_load['tracker'].wait(resource_name)
+        if result.timed_out:
+            firmware_load['timed_out'].append(resource_name)
+        else:
+            firmware_load['durations'].append(result.duration)
+            self._report_firmware_complete(result)
 
-            autoload = "true"
-            autoload_param = get_vm_custom_param(resource_details, "autoload")
-            if autoload_param:
-                autoload = autoload_param.Value
-            if autoload.lower() != "true":
-                self.logger.info("Apps discovery is disabled on deployed app {0}".format(deployed_app_name))
-                continue
+    def _report_skipped_firmware_loads(self, firmware_load):
+        """
+        :param dict firmware_load:
+        :return:
+        """
+        skipped = firmware_load['skipped']
+        if not skipped:
+            return
+        durations = firmware_load['durations']
+        if durations:
+            saved = len(skipped) * sum(durations) / len(durations)
+            message = 'Skipped load_firmware on {0} devices already running version {1}, saving about {2:.0f}s' \
+                .format(len(skipped), firmware_load['version'], saved)
+        else:
+            message = 'Skipped load_firmware on {0} devices already running version {1}' \
+                .format(len(skipped), firmware_load['version'])
+        self.logger.info(message + ': ' + ','.join(skipped))
+        self.output.write(message)
 
-            try:
-                self.logger.info("Executing Autoload command on deployed app {0}".format(deployed_app_name))
-                if not message_written:
-                    api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                        message='Apps are being discovered...')
-                    message_written = True
+    def _report_firmware_complete(self, result):
+        """
+        :param CommandResult result:
+        :return:
+        """
+        self.output.write('Loading firmware complete on ' + result.resource_name + '\n-- Status: ' + result.status)
+        self.logger.info('load_firmware completed on {0} in {1:.0f}s. Status: {2}:{3}'.format(
+            result.resource_name, result.duration, result.status, result.description))
 
+
+    def _try_exeucte_autoload(self, api, deployed_app_name, catalog, lock, message_status):
+        """
+        :param CloudShellAPISession api:
+        :param str deployed_app_name:
+        :param ReservationCatalog catalog:
+        :param Lock lock:
+        :param (dict of str: Boolean) message_status:
+        :return:
+        """
+        resource_details = catalog.get_details(deployed_app_name)
+
+        autoload = "true"
+        autoload_param = get_vm_custom_param(resource_details, "autoload")
+        if autoload_param:
+            autoload = autoload_param.Value
+        if autoload.lower() != "true":
+            self.logger.info("Apps discovery is disabled on deployed app {0}".format(deployed_app_name))
+            return
+
+        started = time.time()
+        try:
+            self.logger.info("Executing Autoload command on deployed app {0}".format(deployed_app_name))
+            if not message_status['autoload']:
+                with lock:
+                    if not message_status['autoload']:
+                        message_status['autoload'] = True
+                        self.output.write('Apps are being discovered...')
+
+            with self.executor.slot('autoload'):
+                started = time.time()  # exclude the time spent waiting for a slot
                 api.AutoLoad(deployed_app_name)
+            catalog.invalidate(deployed_app_name)
+            self.logger.info("Discovery of deployed app {0} took {1:.1f}s".format(deployed_app_name,
+                                                                                  time.time() - started))
 
-            except CloudShellAPIError as exc:
-                if exc.code not in (EnvironmentSetup.NO_DRIVER_ERR, EnvironmentSetup.DRIVER_FUNCTION_ERROR):
-                    self.logger.error(
-                        "Error executing Autoload command on deployed app {0}. Error: {1}".format(deployed_app_name,
-                                                                                                  exc.rawxml))
-                    api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                        message='Discovery failed on "{0}": {1}'
-                                                        .format(deployed_app_name, exc.message))
+        except CloudShellAPIError as exc:
+            if exc.code not in (EnvironmentSetup.NO_DRIVER_ERR, EnvironmentSetup.DRIVER_FUNCTION_ERROR):
+                self.logger.error(
+                    "Error executing Autoload command on deployed app {0} after {1:.1f}s. Error: {2}"
+                    .format(deployed_app_name, time.time() - started, exc.rawxml))
+                self.output.write('Discovery failed on "{0}": {1}'.format(deployed_app_name, exc.message))
 
-            except Exception as exc:
-                self.logger.error("Error executing Autoload command on deployed app {0}. Error: {1}"
-                                  .format(deployed_app_name, str(exc)))
-                api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                    message='Discovery failed on "{0}": {1}'
-                                                    .format(deployed_app_name, exc.message))
+        except Exception as exc:
+            self.logger.error("Error executing Autoload command on deployed app {0} after {1:.1f}s. Error: {2}"
+                              .format(deployed_app_name, time.time() - started, str(exc)))
+            self.output.write('Discovery failed on "{0}": {1}'.format(deployed_app_name, exc.message))
 
     def _deploy_apps_in_reservation(self, api, reservation_details):
         apps = reservation_details.ReservationDescription.Apps
         if not apps or (len(apps) == 1 and not apps[0].Name):
             self.logger.info("No apps found in reservation {0}".format(self.reservation_id))
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                message='No apps to deploy')
+            self.output.write('No apps to deploy')
             return None
 
         app_names = map(lambda x: x.Name, apps)
         app_inputs = map(lambda x: DeployAppInput(x.Name, "Name", x.Name), apps)
 
-        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                            message='Apps deployment started')
+        self.output.write('Apps deployment started')
         self.logger.info(
             "Deploying apps for reservation {0}. App names: {1}".format(reservation_details, ", ".join(app_names)))
 
@@ -323,54 +397,40 @@ class EnvironmentSetup(object):
 
         if not endpoints:
             self.logger.info("No routes to connect for reservation {0}".format(self.reservation_id))
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                message='Nothing to connect')
+            self.output.write('Nothing to connect')
             return
 
         self.logger.info("Executing connect routes for reservation {0}".format(self.reservation_id))
         self.logger.debug("Connecting: {0}".format(",".join(endpoints)))
-        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                            message='Connecting all apps')
+        self.output.write('Connecting all apps')
         res = api.ConnectRoutesInReservation(self.reservation_id, endpoints, 'bi')
         return res
 
-    def _run_async_power_on_refresh_ip_install(self, api, reservation_details, deploy_results, resource_details_cache):
+    def _power_on_refresh_ip_install_or_raise(self, api, lock, message_status, resource, deploy_result, catalog):
         """
         :param CloudShellAPISession api:
-        :param GetReservationDescriptionResponseInfo reservation_details:
-        :param BulkAppDeploymentyInfo deploy_results:
-        :param (dict of str: ResourceInfo) resource_details_cache:
+        :param Lock lock:
+        :param (dict of str: Boolean) message_status:
+        :param ReservedResourceInfo resource:
+        :param BulkAppDeploymentyInfo deploy_result:
+        :param ReservationCatalog catalog:
         :return:
         """
-        resources = reservation_details.ReservationDescription.Resources
-        if len(resources) == 0:
-            api.WriteMessageToReservationOutput(
-                reservationId=self.reservation_id,
-                message='No resources to power on or install')
-            self._validate_all_apps_deployed(deploy_results)
-            return
+        res = self._power_on_refresh_ip_install(api, lock, message_status, resource, deploy_result, catalog)
+        if not res[0]:
+            raise Exception("Reservation is Active with Errors - " + res[1])
 
-        pool = ThreadPool(len(resources))
-        lock = Lock()
-        message_status = {
-            "power_on": False,
-            "wait_for_ip": False,
-            "install": False
-        }
-
-        async_results = [pool.apply_async(self._power_on_refresh_ip_install,
-                                          (api, lock, message_status, resource, deploy_results, resource_details_cache))
-                         for resource in resources]
-
-        pool.close()
-        pool.join()
-
-        for async_result in async_results:
-            res = async_result.get()
-            if not res[0]:
-                raise Exception("Reservation is Active with Errors - " + res[1])
-
-        self._validate_all_apps_deployed(deploy_results)
+    def _may_be_deployed_app(self, catalog, resource):
+        """
+        :param ReservationCatalog catalog:
+        :param ReservedResourceInfo resource:
+        :return: False only if the resource is known not to be a deployed app
+        :rtype: bool
+        """
+        try:
+            return hasattr(get_vm_details(catalog.get_details(resource.Name)), "UID")
+        except Exception:
+            return True  # let _power_on_refresh_ip_install report the error
 
     def _validate_all_apps_deployed(self, deploy_results):
         if deploy_results is not None:
@@ -378,14 +438,14 @@ class EnvironmentSetup(object):
                 if not deploy_res.Success:
                     raise Exception("Reservation is Active with Errors - " + deploy_res.Error)
 
-    def _power_on_refresh_ip_install(self, api, lock, message_status, resource, deploy_result, resource_details_cache):
+    def _power_on_refresh_ip_install(self, api, lock, message_status, resource, deploy_result, catalog):
         """
         :param CloudShellAPISession api:
         :param Lock lock:
         :param (dict of str: Boolean) message_status:
         :param ReservedResourceInfo resource:
         :param BulkAppDeploymentyInfo deploy_result:
-        :param (dict of str: ResourceInfo) resource_details_cache:
+        :param ReservationCatalog catalog:
         :return:
         """
 
@@ -399,10 +459,7 @@ class EnvironmentSetup(object):
             self.logger.debug("Getting resource details for resource {0} in reservation {1}"
                               .format(deployed_app_name, self.reservation_id))
 
-            if deployed_app_name in resource_details_cache:
-                resource_details = resource_details_cache[deployed_app_name]
-            else:
-                resource_details = api.GetResourceDetails(deployed_app_name)
+            resource_details = catalog.get_details(deployed_app_name)
 
             # check if deployed app
             vm_details = get_vm_details(resource_details)
@@ -470,16 +527,16 @@ class EnvironmentSetup(object):
                 with lock:
                     if not message_status['install']:
                         message_status['install'] = True
-                        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                            message='Apps are installing...')
+                        self.output.write('Apps are installing...')
 
             script_inputs = []
             for installation_script_input in installation_info.ScriptInputs:
                 script_inputs.append(
                     InputNameValue(installation_script_input.Name, installation_script_input.Value))
 
-            installation_result = api.InstallApp(self.reservation_id, deployed_app_name,
-                                                 installation_info.ScriptCommandName, script_inputs)
+            with self.executor.slot('install'):
+                installation_result = api.InstallApp(self.reservation_id, deployed_app_name,
+                                                     installation_info.ScriptCommandName, script_inputs)
 
             self.logger.debug("Installation_result: " + installation_result.Output)
 
@@ -490,16 +547,15 @@ class EnvironmentSetup(object):
                 with lock:
                     if not message_status['wait_for_ip']:
                         message_status['wait_for_ip'] = True
-                        api.WriteMessageToReservationOutput(
-                            reservationId=self.reservation_id,
-                            message='Waiting for apps IP addresses, this may take a while...')
+                        self.output.write('Waiting for apps IP addresses, this may take a while...')
 
             self.logger.info("Executing 'Refresh IP' on deployed app {0} in reservation {1}"
                              .format(deployed_app_name, self.reservation_id))
 
-            api.ExecuteResourceConnectedCommand(self.reservation_id, deployed_app_name,
-                                                "remote_refresh_ip",
-                                                "remote_connectivity")
+            with self.executor.slot('refresh_ip'):
+                api.ExecuteResourceConnectedCommand(self.reservation_id, deployed_app_name,
+                                                    "remote_refresh_ip",
+                                                    "remote_connectivity")
         else:
             self.logger.info("Wait For IP is off for deployed app {0} in reservation {1}"
                              .format(deployed_app_name, self.reservation_id))
@@ -513,10 +569,10 @@ class EnvironmentSetup(object):
                 with lock:
                     if not message_status['power_on']:
                         message_status['power_on'] = True
-                        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                            message='Apps are powering on...')
+                        self.output.write('Apps are powering on...')
 
-            api.ExecuteResourceConnectedCommand(self.reservation_id, deployed_app_name, "PowerOn", "power")
+            with self.executor.slot('power_on'):
+                api.ExecuteResourceConnectedCommand(self.reservation_id, deployed_app_name, "PowerOn", "power")
         else:
             self.logger.info("Auto Power On is off for deployed app {0} in reservation {1}"
                              .format(deployed_app_name, self.reservation_id))
@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from threading import BoundedSemaphore, Lock
+
+from sandbox_scripts.profiler.tracer import span
+
+
+class OperationExecutor(object):
+    """
+    Shared concurrency limits per operation type (power on, refresh IP, ...). Work is either run through map,
+    which uses a pool sized to the operation limit, or wrapped in slot by threads that already exist.
+    Limits can be overridden with 'quali_concurrency_<operation>' global inputs.
+    """
+    GLOBAL_INPUT_PREFIX = 'quali_concurrency_'
+    DEFAULT_LIMITS = {
+        'power_on': 10,
+        'refresh_ip': 10,
+        'install': 5,
+        'power_off': 10,
+        'autoload': 5,
+        'reset': 20
+    }
+    DEFAULT_LIMIT = 10
+
+    def __init__(self, logger, limits=None):
+        """
+        :param logger:
+        :param (dict of str: int) limits: operation -> maximum number of concurrent calls
+        """
+        self.logger = logger
+        self.limits = dict(OperationExecutor.DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self._semaphores = {}
+        self._running = {}
+        self._queued = {}
+        self._peak_running = {}
+        self._peak_queued = {}
+        self._lock = Lock()
+
+    @classmethod
+    def from_global_inputs(cls, logger, global_inputs):
+        """
+        :param logger:
+        :param dict global_inputs:
+        :rtype: OperationExecutor
+        """
+        limits = {}
+        for name, value in global_inputs.items():
+            if name.startswith(cls.GLOBAL_INPUT_PREFIX) and value:
+                try:
+                    limits[name[len(cls.GLOBAL_INPUT_PREFIX):]] = max(1, int(value))
+                except ValueError:
+                    logger.warning("Ignoring invalid concurrency limit {0}={1}".format(name, value))
+        return cls(logger, limits)
+
+    def limit(self, operation):
+        """
+        :param str operation:
+        :rtype: int
+        """
+        return self.limits.get(operation, OperationExecutor.DEFAULT_LIMIT)
+
+    @contextmanager
+    def slot(self, operation):
+        """
+        Blocks until fewer than limit(operation) calls of the operation are running
+        :param str operation:
+        """
+        with self._lock:
+            if operation not in self._semaphores:
+                self._semaphores[operation] = BoundedSemaphore(self.limit(operation))
+                self._running[operation] = 0
+                self._queued[operation] = 0
+                self._peak_running[operation] = 0
+                self._peak_queued[operation] = 0
+            semaphore = self._semaphores[operation]
+            self._queued[operation] += 1
+            self._peak_queued[operation] = max(self._peak_queued[operation], self._queued[operation])
+            self._log_gauge(operation)
+
+        with span('wait for ' + operation, 'queue'):
+            semaphore.acquire()
+        with self._lock:
+            self._queued[operation] -= 1
+            self._running[operation] += 1
+            self._peak_running[operation] = max(self._peak_running[operation], self._running[operation])
+            self._log_gauge(operation)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running[operation] -= 1
+                self._log_gauge(operation)
+            semaphore.release()
+
+    def map(self, operation, func, items):
+        """
+        Runs func on every item, at most limit(operation) at a time
+        :param str operation:
+        :param func:
+        :param list items:
+        :return: results in the order of items
+        :rtype: list
+        """
+        if not items:
+            return []
+
+        def run(item):
+            with self.slot(operation):
+                return func(item)
+
+        pool = ThreadPool(min(len(items), self.limit(operation)))
+        try:
+            # one item per task, so no worker holds back an item while others are idle
+            return pool.map(run, items, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def summary(self):
+        """
+        :return: peak running and queued calls of every operation used so far
+        :rtype: str
+        """
+        with self._lock:
+            if not self._semaphores:
+                return "No limited operations executed"
+            return "Operation concurrency: " + ", ".join(
+                "{0} peak {1} running / {2} queued (limit {3})".format(operation, self._peak_running[operation],
+                                                                       self._peak_queued[operation],
+                                                                       self.limit(operation))
+                for operation in sorted(self._semaphores))
+
+    def _log_gauge(self, operation):
+        self.logger.debug("{0}: {1} running, {2} queued".format(operation, self._running[operation],
+                                                                self._queued[operation]))
@@ -0,0 +1,131 @@
+import time
+from threading import Condition, Thread
+
+from sandbox_scripts.profiler.tracer import span
+
+
+class TaskResult(object):
+    def __init__(self, name, success, value=None, error=None, duration=0.0, skipped=False):
+        """
+        :param str name:
+        :param bool success:
+        :param value: return value of the task function
+        :param Exception error: exception raised by the task, or by the dependency that caused it to be skipped
+        :param float duration: seconds the task ran
+        :param bool skipped: True when the task did not run because a dependency failed
+        """
+        self.name = name
+        self.success = success
+        self.value = value
+        self.error = error
+        self.duration = duration
+        self.skipped = skipped
+
+
+class TaskGraph(object):
+    """
+    Runs named tasks, each in its own thread, as soon as every task it depends on succeeded. Tasks whose
+    dependencies failed are skipped. Running tasks may add new tasks to the graph, e.g. one per deployed app.
+    """
+
+    def __init__(self, logger, on_complete=None):
+        """
+        :param logger:
+        :param on_complete: optional callable receiving the TaskResult of every task that ran, called before the
+                            tasks depending on it can start
+        """
+        self.logger = logger
+        self.on_complete = on_complete
+        self.results = {}
+        self._tasks = {}
+        self._order = []
+        self._running = set()
+        self._condition = Condition()
+
+    def add(self, name, func, args=(), depends_on=()):
+        """
+        :param str name: unique task name
+        :param func: callable run with args
+        :param tuple args:
+        :param depends_on: names of the tasks that must succeed before this one starts
+        """
+        with self._condition:
+            if name in self._tasks:
+                raise ValueError('Task {0} already exists'.format(name))
+            self._tasks[name] = (func, args, tuple(depends_on))
+            self._order.append(name)
+            self._condition.notify()
+
+    def __contains__(self, name):
+        with self._condition:
+            return name in self._tasks
+
+    def run(self):
+        """
+        Runs the tasks until every task completed or was skipped
+        :return: task name -> TaskResult
+        :rtype: dict
+        """
+        with self._condition:
+            while True:
+                self._start_ready_tasks()
+                if not self._running:
+                    break
+                self._condition.wait()
+
+            # anything left depends on a task that was never added
+            for name in self._order:
+                if name not in self.results:
+                    self.results[name] = TaskResult(name, False, skipped=True,
+                                                    error=Exception('Unknown dependency of task ' + name))
+        return self.results
+
+    def failures(self):
+        """
+        :return: results of the tasks that ran and failed, in the order the tasks were added
+        :rtype: list[TaskResult]
+        """
+        with self._condition:
+            return [self.results[name] for name in self._order
+                    if name in self.results and not self.results[name].success and not self.results[name].skipped]
+
+    def _start_ready_tasks(self):
+        changed = True
+        while changed:
+            changed = False
+            for name in self._order:
+                if name in self.results or name in self._running:
+                    continue
+                func, args, depends_on = self._tasks[name]
+                failed = [dependency for dependency in depends_on
+                          if dependency in self.results and not self.results[dependency].success]
+                if failed:
+                    self.logger.debug('Skipping task {0}, dependency {1} failed'.format(name, failed[0]))
+                    self.results[name] = TaskResult(name, False, skipped=True, error=self.results[failed[0]].error)
+                    changed = True
+                elif all(dependency in self.results for dependency in depends_on):
+                    self._running.add(name)
+                    thread = Thread(target=self._run_task, args=(name, func, args), name=name)
+                    thread.daemon = True
+                    thread.start()
+
+    def _run_task(self, name, func, args):
+        started = time.time()
+        try:
+            with span(name, 'task'):
+                value = func(*args)
+            result = TaskResult(name, True, value=value, duration=time.time() - started)
+        except Exception as exc:
+            self.logger.error('Task {0} failed. Error: {1}'.format(name, str(exc)))
+            result = TaskResult(name, False, error=exc, duration=time.time() - started)
+
+        if self.on_complete is not None:
+            try:
+                self.on_complete(result)
+            except Exception as exc:
+                self.logger.warning('Error completing task {0}. Error: {1}'.format(name, str(exc)))
+
+        with self._condition:
+            self._running.discard(name)
+            self.results[name] = result
+            self._condition.notify()
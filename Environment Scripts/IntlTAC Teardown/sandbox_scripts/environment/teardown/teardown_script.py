@@ -1,4 +1,5 @@
 # coding=utf-8
+import os
 from multiprocessing.pool import ThreadPool
 from threading import Lock
 
@@ -6,154 +7,207 @@ from cloudshell.helpers.scripts import cloudshell_scripts_helpers as helpers
 from cloudshell.api.common_cloudshell_api import CloudShellAPIError
 from cloudshell.core.logger import qs_logger
 from sandbox_scripts.profiler.env_profiler import profileit
+from sandbox_scripts.profiler.tracer import span
 from sandbox_scripts.helpers.resource_helpers import get_vm_custom_param, get_resources_created_in_res
+from sandbox_scripts.helpers.command_dispatcher import CommandDispatcher
+from sandbox_scripts.helpers.command_tracker import CommandTracker
+from sandbox_scripts.helpers.instrumented_api import InstrumentedApiSession
+from sandbox_scripts.helpers.config_baseline import ConfigBaseline
+from sandbox_scripts.helpers.operation_executor import OperationExecutor
+from sandbox_scripts.helpers.reservation_catalog import ReservationCatalog
+from sandbox_scripts.helpers.reservation_output import ReservationOutput
+from sandbox_scripts.helpers.task_graph import TaskGraph
 from cloudshell.api.cloudshell_api import ReservationDescriptionInfo
-import time
 
 class EnvironmentTeardown:
     REMOVE_DEPLOYED_RESOURCE_ERROR = 153
+    # commands run one after the other on every device that supports them, with their progress messages
+    RESET_CHAIN = [
+        ('reset', 'Resetting {0} to factory default', 'Factory reset complete on ', 'factory reset'),
+        ('restore_device_id', 'Restoring device id on {0}', 'Retore device ID complete on ', 'restoring device id')
+    ]
 
     def __init__(self):
         self.reservation_id = helpers.get_reservation_context_details().id
         self.logger = qs_logger.get_qs_logger(log_file_prefix="CloudShell Sandbox Teardown",
                                               log_group=self.reservation_id,
                                               log_category='Teardown')
+        self.executor = OperationExecutor.from_global_inputs(
+            self.logger, helpers.get_reservation_context_details().parameters.global_inputs)
 
     @profileit(scriptName="Teardown")
     def execute(self):
-        api = helpers.get_api_session()
-        reservation_details = api.GetReservationDetails(self.reservation_id)
+        api = InstrumentedApiSession(helpers.get_api_session())
+        catalog = ReservationCatalog(api, self.reservation_id, self.logger)
 
-        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                            message='Beginning reservation teardown')
-
-        self._disconnect_all_routes_in_reservation(api, reservation_details)
-
-        self._power_off_and_delete_all_vm_resources(api, reservation_details, self.reservation_id)
-
-        self._cleanup_connectivity(api, self.reservation_id)
-
-        reservation_details = api.GetReservationDetails(self.reservation_id)
-        self._reset_devices(api, reservation_details)
-
-        self.logger.info("Teardown for reservation {0} completed".format(self.reservation_id))
-        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                            message='Reservation teardown finished successfully')
-
-
-    def _reset_devices(self, api, reservation_details):
+        self.output = ReservationOutput(api, self.reservation_id, self.logger)
+        try:
+            reservation_details = catalog.refresh()
+
+            self.output.write('Beginning reservation teardown')
+
+            # Devices are reset while the apps are deleted, a step starts once the steps it depends on are done
+            graph = TaskGraph(self.logger, on_complete=lambda result: self.output.flush())
+            graph.add('disconnect_routes', self._disconnect_all_routes_in_reservation, (api, reservation_details))
+            graph.add('power_off_and_delete', self._power_off_and_delete_all_vm_resources,
+                      (api, reservation_details, self.reservation_id, catalog), depends_on=['disconnect_routes'])
+            graph.add('cleanup_connectivity', self._cleanup_connectivity, (api, self.reservation_id),
+                      depends_on=['power_off_and_delete'])
+            graph.add('reset_devices', self._reset_devices, (api, reservation_details, catalog),
+                      depends_on=['disconnect_routes'])
+            graph.run()
+
+            self.logger.info(self.executor.summary())
+            for result in sorted(graph.results.values(), key=lambda task_result: task_result.name):
+                self.logger.debug('Teardown step {0} took {1:.0f}s'.format(result.name, result.duration))
+
+            failures = graph.failures()
+            if failures:
+                raise failures[0].error
+
+            self.logger.info("Teardown for reservation {0} completed".format(self.reservation_id))
+            self.output.write('Reservation teardown finished successfully')
+        finally:
+            self.output.close()
+            self._report_api_usage(api)
+
+    def _report_api_usage(self, api):
+        """
+        Logs the API calls made by the teardown, and saves them to the 'quali_api_stats' directory when set
+        :param InstrumentedApiSession api:
+        :return:
         """
+        self.logger.info('API calls of reservation teardown:\n' + api.summary())
+        reservation_context = helpers.get_reservation_context_details()
+        api_stats_dir = reservation_context.parameters.global_inputs.get('quali_api_stats')
+        if not api_stats_dir:
+            return
+        try:
+            api.write_json(os.path.join(api_stats_dir, 'Teardown_{0}_{1}.api.json'.format(
+                reservation_context.environment_name, self.reservation_id)))
+        except Exception as exc:
+            self.logger.warning('Unable to save API call statistics. Error: {0}'.format(str(exc)))
 
+    def _reset_devices(self, api, reservation_details, catalog):
+        """
+        Runs the reset chain on every device, each device moves to its next command as soon as its own
+        previous command completed
         :param api:
         :param reservation_details:  ReservationDescriptionInfo
+        :param ReservationCatalog catalog:
         :return:
         """
-
-        running_resources = []
-        for resource in reservation_details.ReservationDescription.Resources:
-            if '/' not in resource.FullAddress:
-
-                command_list = api.GetResourceCommands(resource.Name).Commands
-
-                for command in command_list:
-                    if command.Name == 'reset':
-                        api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message='Resetting ' +
-                                                            resource.Name + ' to factory default')
-                        try:
-                            api.EnqueueCommand(self.reservation_id, resource.Name, 'Resource', 'reset')
-                            running_resources.append(resource.Name)
-                            time.sleep(2)
-                        except Exception as exc:
-                            self.logger.error('Error resetting {0} to factory default. Error: {1}'.format(resource.Name,
-                                                                                                          str(exc)))
-                        break
-
-        time.sleep(30)
-        command_completion = False
-        loop_count = 0
-        running_resources_copy = running_resources
-        while not command_completion and loop_count < 120:
-            still_running = False
-            for resource in running_resources:
-                status = api.GetResourceLiveStatus(resource)
-
-                if status.liveStatusName == 'Progress 10':
-                    still_running = True
-                else:
-                    api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                        message='Factory reset complete on ' +
-                                                                resource)
-                    api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message='-- Status: ' +
-                                                                                                   status.liveStatusName)
-                    self.logger.info(
-                        'reset completed on {0}. Status: {1}:{2}'.format(resource, status.liveStatusName,
-                                                                                 status.liveStatusDescription))
-                    running_resources_copy.remove(resource)
-            if not still_running:
-                command_completion = True
-
-            loop_count += 1
-            time.sleep(10)
-
-        if not command_completion:
-            self.logger.error(
-                "At least one resource did not complete reset: " + ','.join(running_resources_copy))
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                message='The following resources failed to complete factory reset: ' +
-                                                        ','.join(running_resources_copy))
-
-        running_resources = []
+        chain_commands = [command[0] for command in EnvironmentTeardown.RESET_CHAIN]
+        # resources created in the reservation are deleted by _power_off_and_delete_all_vm_resources
+        created_in_reservation = set(resource.Name for resource in
+                                     get_resources_created_in_res(reservation_details=reservation_details,
+                                                                  reservation_id=self.reservation_id))
+        devices = []
         for resource in reservation_details.ReservationDescription.Resources:
-            if '/' not in resource.FullAddress:
-
-                command_list = api.GetResourceCommands(resource.Name).Commands
-
-                for command in command_list:
-                    if command.Name == 'restore_device_id':
-                        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                            message='Restoring device id on ' + resource.Name)
-                        try:
-                            api.EnqueueCommand(self.reservation_id, resource.Name, 'Resource', 'restore_device_id')
-                            running_resources.append(resource.Name)
-                            time.sleep(2)
-                        except Exception as exc:
-                            self.logger.error('Error restoring device id on {0}. Error: {1}'.format(resource.Name,
-                                                                                                          str(exc)))
-                        break
-
-        time.sleep(30)
-        command_completion = False
-        loop_count = 0
-        running_resources_copy = running_resources
-        while not command_completion and loop_count < 120:
-            still_running = False
-            for resource in running_resources:
-                status = api.GetResourceLiveStatus(resource)
-
-                if status.liveStatusName == 'Progress 10':
-                    still_running = True
-                else:
-                    api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                        message='Retore device ID complete on ' +
-                                                                resource)
-                    api.WriteMessageToReservationOutput(reservationId=self.reservation_id, message='-- Status: ' +
-                                                                                                   status.liveStatusName)
-                    self.logger.info(
-                        'restore_device_id completed on {0}. Status: {1}:{2}'.format(resource, status.liveStatusName,
-                                                                                 status.liveStatusDescription))
-                    running_resources_copy.remove(resource)
-            if not still_running:
-                command_completion = True
-
-            loop_count += 1
-            time.sleep(10)
-
-        if not command_completion:
-            self.logger.error(
-                "At least one resource did not complete restore_device_id: " + ','.join(running_resources_copy))
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                message='The following resources failed to complete restoring device id: ' +
-                                                        ','.join(running_resources_copy))
+            if '/' not in resource.FullAddress and resource.Name not in created_in_reservation:
+                commands = [command_name for command_name in catalog.get_commands(resource.Name)
+                            if command_name in chain_commands]
+                if commands:
+                    devices.append((resource.Name, commands))
+
+        # devices whose config did not change since the end of setup are left as they are
+        config_baseline = ConfigBaseline(api, self.reservation_id, self.logger)
+        baseline = config_baseline.load()
+        if not baseline:
+            self.logger.info('No config baseline saved by setup, resetting all devices')
+        skipped = []
+
+        # every device waits for its own commands, only the enqueues are limited by the 'reset' slots
+        dispatcher = CommandDispatcher(api, self.reservation_id, self.logger)
+        tracker = CommandTracker(api, self.logger)
+        results = []
+        if devices:
+            pool = ThreadPool(len(devices))
+            async_results = [pool.apply_async(self._reset_device,
+                                              (api, dispatcher, tracker, resource_name, commands, config_baseline,
+                                               baseline.get(resource_name), skipped))
+                             for resource_name, commands in devices]
+            pool.close()
+            pool.join()
+            results = [async_result.get() for async_result in async_results]
+        self.logger.info(dispatcher.summary())
+        config_baseline.discard()
+
+        if skipped:
+            self.logger.info('Skipped factory reset of {0} unchanged devices: {1}'.format(len(skipped),
+                                                                                          ','.join(skipped)))
+            self.output.write('Skipped factory reset of {0} devices with unchanged config'.format(len(skipped)))
+
+        for command_name, _, _, description in EnvironmentTeardown.RESET_CHAIN:
+            timed_out = [resource_name for (resource_name, _), device_timed_out in zip(devices, results)
+                         if command_name in device_timed_out]
+            if timed_out:
+                self.logger.error(
+                    "At least one resource did not complete {0}: ".format(command_name) + ','.join(timed_out))
+                self.output.write('The following resources failed to complete {0}: '.format(description) +
+                                  ','.join(timed_out))
+
+    def _reset_device(self, api, dispatcher, tracker, resource_name, commands, config_baseline,
+                      baseline_fingerprint, skipped):
+        """
+        :param CloudShellAPISession api:
+        :param CommandDispatcher dispatcher:
+        :param CommandTracker tracker:
+        :param str resource_name:
+        :param list[str] commands: the reset chain commands the device supports
+        :param ConfigBaseline config_baseline:
+        :param str baseline_fingerprint: fingerprint of the device config at the end of setup, None if unknown
+        :param list[str] skipped: the device name is added when its config is unchanged
+        :return: the commands that did not complete in time
+        :rtype: list[str]
+        """
+        with span('reset ' + resource_name, 'device'):
+            return self._run_reset_chain(api, dispatcher, tracker, resource_name, commands, config_baseline,
+                                         baseline_fingerprint, skipped)
+
+    def _run_reset_chain(self, api, dispatcher, tracker, resource_name, commands, config_baseline,
+                         baseline_fingerprint, skipped):
+        timed_out = []
+        if baseline_fingerprint:
+            if config_baseline.fingerprint(resource_name) == baseline_fingerprint:
+                self.logger.info('Skipping reset of {0}, running config unchanged since setup'.format(resource_name))
+                skipped.append(resource_name)
+                return timed_out
+            self.logger.info('Resetting {0}, running config changed since setup'.format(resource_name))
+        else:
+            self.logger.info('Resetting {0}, no config baseline'.format(resource_name))
+
+        for command_name, start_message, complete_message, _ in EnvironmentTeardown.RESET_CHAIN:
+            if command_name not in commands:
+                continue
+            self.output.write(start_message.format(resource_name))
+            try:
+                with self.executor.slot('reset'):
+                    dispatcher.enqueue(resource_name, command_name)
+            except Exception as exc:
+                self.logger.error('Error executing {0} on {1}. Error: {2}'.format(command_name, resource_name,
+                                                                                  str(exc)))
+                continue
+
+            result = tracker.wait(resource_name)
+            if result.timed_out:
+                timed_out.append(command_name)
+            else:
+                self._report_command_complete(result, command_name, complete_message)
+        return timed_out
+
+    def _report_command_complete(self, result, command_name, message):
+        """
+        :param CommandResult result:
+        :param str command_name:
+        :param str message:
+        :return:
+        """
+        self.output.write(message + result.resource_name + '\n-- Status: ' + result.status)
+        self.logger.info(
+            '{0} completed on {1} in {2:.0f}s. Status: {3}:{4}'.format(command_name, result.resource_name,
+                                                                      result.duration, result.status,
+                                                                      result.description))
 
     def _disconnect_all_routes_in_reservation(self, api, reservation_details):
         connectors = reservation_details.ReservationDescription.Connectors
@@ -169,57 +223,48 @@ class EnvironmentTeardown:
 
         try:
             self.logger.info("Executing disconnect routes for reservation {0}".format(self.reservation_id))
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                message="Disconnecting all apps...")
+            self.output.write("Disconnecting all apps...")
             api.DisconnectRoutesInReservation(self.reservation_id, endpoints)
 
         except CloudShellAPIError as cerr:
             if cerr.code != "123":  # ConnectionNotFound error code
                 self.logger.error("Error disconnecting all routes in reservation {0}. Error: {1}"
                                   .format(self.reservation_id, str(cerr)))
-                api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                    message="Error disconnecting apps. Error: {0}".format(cerr.message))
+                self.output.write("Error disconnecting apps. Error: {0}".format(cerr.message))
 
         except Exception as exc:
             self.logger.error("Error disconnecting all routes in reservation {0}. Error: {1}"
                               .format(self.reservation_id, str(exc)))
-            api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                message="Error disconnecting apps. Error: {0}".format(exc.message))
+            self.output.write("Error disconnecting apps. Error: {0}".format(exc.message))
 
-    def _power_off_and_delete_all_vm_resources(self, api, reservation_details, reservation_id):
+    def _power_off_and_delete_all_vm_resources(self, api, reservation_details, reservation_id, catalog):
         """
         :param CloudShellAPISession api:
         :param GetReservationDescriptionResponseInfo reservation_details:
         :param str reservation_id:
+        :param ReservationCatalog catalog:
         :return:
         """
         # filter out resources not created in this reservation
         resources = get_resources_created_in_res(reservation_details=reservation_details,
                                                  reservation_id=reservation_id)
 
-        pool = ThreadPool()
-        async_results = []
         lock = Lock()
         message_status = {
             "power_off": False,
             "delete": False
         }
 
-        for resource in resources:
-            resource_details = api.GetResourceDetails(resource.Name)
-            if resource_details.VmDetails:
-                result_obj = pool.apply_async(self._power_off_or_delete_deployed_app,
-                                              (api, resource_details, lock, message_status))
-                async_results.append(result_obj)
+        deployed_apps = [resource_details for resource_details in
+                         [catalog.get_details(resource.Name) for resource in resources]
+                         if resource_details.VmDetails]
 
-        pool.close()
-        pool.join()
+        results = self.executor.map('power_off',
+                                    lambda resource_details: self._power_off_or_delete_deployed_app(
+                                        api, resource_details, lock, message_status),
+                                    deployed_apps)
 
-        resource_to_delete = []
-        for async_result in async_results:
-            result = async_result.get()
-            if result is not None:
-                resource_to_delete.append(result)
+        resource_to_delete = [result for result in results if result is not None]
 
         # delete resource - bulk
         if resource_to_delete:
@@ -229,8 +274,7 @@ class EnvironmentTeardown:
                 if exc.code == EnvironmentTeardown.REMOVE_DEPLOYED_RESOURCE_ERROR:
                     self.logger.error(
                             "Error executing RemoveResourcesFromReservation command. Error: {0}".format(exc.message))
-                    api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                        message=exc.message)
+                    self.output.write(exc.message)
 
     def _power_off_or_delete_deployed_app(self, api, resource_info, lock, message_status):
         """
@@ -241,6 +285,10 @@ class EnvironmentTeardown:
         :return:
         """
         resource_name = resource_info.Name
+        with span('power off or delete ' + resource_name, 'device'):
+            return self._power_off_or_delete(api, resource_name, resource_info, lock, message_status)
+
+    def _power_off_or_delete(self, api, resource_name, resource_info, lock, message_status):
         try:
             delete = "true"
             auto_delete_param = get_vm_custom_param(resource_info, "auto_delete")
@@ -257,11 +305,9 @@ class EnvironmentTeardown:
                             message_status['delete'] = True
                             if not message_status['power_off']:
                                 message_status['power_off'] = True
-                                api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                                    message='Apps are being powered off and deleted...')
+                                self.output.write('Apps are being powered off and deleted...')
                             else:
-                                api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                                    message='Apps are being deleted...')
+                                self.output.write('Apps are being deleted...')
 
                 # removed call to destroy_vm_only from this place because it will be called from
                 # the server in RemoveResourcesFromReservation
@@ -281,8 +327,7 @@ class EnvironmentTeardown:
                         with lock:
                             if not message_status['power_off']:
                                 message_status['power_off'] = True
-                                api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                                                    message='Apps are powering off...')
+                                self.output.write('Apps are powering off...')
 
                     api.ExecuteResourceConnectedCommand(self.reservation_id, resource_name, "PowerOff", "power")
                 else:
@@ -301,6 +346,5 @@ class EnvironmentTeardown:
         :return:
         """
         self.logger.info("Cleaning-up connectivity for reservation {0}".format(self.reservation_id))
-        api.WriteMessageToReservationOutput(reservationId=self.reservation_id,
-                                            message='Cleaning-up connectivity')
+        self.output.write('Cleaning-up connectivity')
         api.CleanupSandboxConnectivity(reservation_id)
@@ -0,0 +1,139 @@
+import random
+import time
+from threading import Lock
+
+
+class DispatchResult(object):
+    def __init__(self, resource_name, command_name, success, latency, retries, error=None):
+        """
+        :param str resource_name:
+        :param str command_name:
+        :param bool success:
+        :param float latency: seconds taken by the last EnqueueCommand call of this command, the calls rejected as
+                              busy excluded
+        :param int retries: number of 'resource temporarily unavailable' retries
+        :param str error:
+        """
+        self.resource_name = resource_name
+        self.command_name = command_name
+        self.success = success
+        self.latency = latency
+        self.retries = retries
+        self.error = error
+
+
+class CommandDispatcher(object):
+    """
+    Sends EnqueueCommand calls as fast as the server accepts them. Calls rejected with
+    'resource temporarily unavailable' are retried with jittered exponential backoff, and every rejection widens
+    the spacing between consecutive enqueues, which then shrinks again on each accepted call.
+    """
+    BUSY_ERROR = 'resource temporarily unavailable'
+
+    def __init__(self, api, reservation_id, logger, max_retries=6, base_delay=0.5, max_delay=8,
+                 max_interval=5):
+        """
+        :param CloudShellAPISession api:
+        :param str reservation_id:
+        :param logger:
+        :param max_retries: retries of a single enqueue before giving up
+        :param base_delay: first retry backoff, in seconds
+        :param max_delay: upper bound of a retry backoff, in seconds
+        :param max_interval: upper bound of the spacing between consecutive enqueues, in seconds
+        """
+        self.api = api
+        self.reservation_id = reservation_id
+        self.logger = logger
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_interval = max_interval
+        self.results = []
+        self._interval = 0.0
+        self._next_send = 0.0
+        self._lock = Lock()
+
+    def enqueue(self, resource_name, command_name, command_inputs=None):
+        """
+        Enqueues a resource command, retrying while the server reports it is busy
+        :param str resource_name:
+        :param str command_name:
+        :param list[InputNameValue] command_inputs:
+        :rtype: DispatchResult
+        :raises Exception: the last error when the command could not be enqueued
+        """
+        retries = 0
+        while True:
+            self._wait_turn()
+            call_started = time.time()
+            try:
+                if command_inputs:
+                    self.api.EnqueueCommand(self.reservation_id, resource_name, 'Resource', command_name,
+                                            command_inputs)
+                else:
+                    self.api.EnqueueCommand(self.reservation_id, resource_name, 'Resource', command_name)
+            except Exception as exc:
+                latency = time.time() - call_started
+                if not self._is_busy_error(exc) or retries >= self.max_retries:
+                    self._record(DispatchResult(resource_name, command_name, False, latency, retries, str(exc)))
+                    raise
+                retries += 1
+                delay = self._slow_down(retries)
+                self.logger.debug("Server busy enqueuing {0} on {1}, retry {2} in {3:.2f}s"
+                                  .format(command_name, resource_name, retries, delay))
+                time.sleep(delay)
+                continue
+
+            latency = time.time() - call_started
+            self._speed_up()
+            return self._record(DispatchResult(resource_name, command_name, True, latency, retries))
+
+    def summary(self):
+        """
+        :return: one line describing latency and retries of all the enqueues done so far
+        :rtype: str
+        """
+        with self._lock:
+            results = list(self.results)
+            interval = self._interval
+        if not results:
+            return "No commands enqueued"
+
+        latencies = [result.latency for result in results]
+        return "Enqueued {0} commands ({1} failed): latency avg {2:.2f}s max {3:.2f}s, {4} retries, " \
+               "current spacing {5:.2f}s".format(len(results),
+                                                 len([result for result in results if not result.success]),
+                                                 sum(latencies) / len(latencies), max(latencies),
+                                                 sum(result.retries for result in results), interval)
+
+    def _record(self, result):
+        with self._lock:
+            self.results.append(result)
+        self.logger.debug("EnqueueCommand {0} on {1}: {2} in {3:.2f}s after {4} retries"
+                          .format(result.command_name, result.resource_name,
+                                  'success' if result.success else 'failed', result.latency, result.retries))
+        return result
+
+    def _wait_turn(self):
+        with self._lock:
+            now = time.time()
+            send_at = max(now, self._next_send)
+            self._next_send = send_at + self._interval
+        if send_at > now:
+            time.sleep(send_at - now)
+
+    def _slow_down(self, retries):
+        with self._lock:
+            self._interval = min(self.max_interval, max(self._interval * 2, 0.25))
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retries))
+
+    def _speed_up(self):
+        with self._lock:
+            self._interval /= 2
+            if self._interval < 0.05:
+                self._interval = 0.0
+
+    @staticmethod
+    def _is_busy_error(exc):
+        message = getattr(exc, 'message', None) or str(exc)
+        return CommandDispatcher.BUSY_ERROR in str(message).lower()
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+from sandbox_scripts.helpers.file_utils import atomic_write
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'gigamon_cache')
+
+
+class ConfigBaseline(object):
+    """
+    Fingerprints of the device running configs taken at the end of setup, so teardown only resets the devices
+    whose config changed during the reservation. The baseline is kept in a file of the execution server, a
+    device without a baseline is always reset.
+    """
+    FINGERPRINT_COMMAND = 'get_running_config'
+
+    def __init__(self, api, reservation_id, logger, cache_dir=DEFAULT_CACHE_DIR, max_workers=16):
+        """
+        :param CloudShellAPISession api:
+        :param str reservation_id:
+        :param logger:
+        :param str cache_dir:
+        :param int max_workers: maximum number of configs read concurrently
+        """
+        self.api = api
+        self.reservation_id = reservation_id
+        self.logger = logger
+        self.path = os.path.join(cache_dir, 'config_baseline_{0}.json'.format(reservation_id))
+        self.max_workers = max_workers
+
+    def fingerprint(self, resource_name):
+        """
+        :param str resource_name: resource exposing FINGERPRINT_COMMAND
+        :return: sha1 of the running config, None if it could not be read
+        :rtype: str
+        """
+        try:
+            result = self.api.ExecuteCommand(self.reservation_id, resource_name, 'Resource',
+                                             ConfigBaseline.FINGERPRINT_COMMAND, [], False)
+        except Exception as exc:
+            self.logger.warning('Unable to read the running config of {0}. Error: {1}'.format(resource_name,
+                                                                                             str(exc)))
+            return None
+
+        # comment lines carry the generation time and change on every read
+        lines = [line.strip() for line in (result.Output or '').splitlines()]
+        config = '\n'.join(line for line in lines if line and not line.startswith(('#', '!')))
+        if not config:
+            return None
+        return hashlib.sha1(config.encode('utf-8') if isinstance(config, unicode) else config).hexdigest()
+
+    def capture(self, resource_names):
+        """
+        Fingerprints the devices concurrently and saves the baseline
+        :param list[str] resource_names:
+        :return: resource name -> fingerprint of the devices whose config could be read
+        :rtype: dict
+        """
+        if not resource_names:
+            return {}
+        pool = ThreadPool(min(len(resource_names), self.max_workers))
+        try:
+            fingerprints = pool.map(self.fingerprint, resource_names)
+        finally:
+            pool.close()
+            pool.join()
+
+        baseline = dict((resource_name, fingerprint) for resource_name, fingerprint
+                        in zip(resource_names, fingerprints) if fingerprint)
+        try:
+            self._write(baseline)
+        except Exception as exc:
+            self.logger.warning('Unable to save the config baseline. Error: {0}'.format(str(exc)))
+        return baseline
+
+    def load(self):
+        """
+        :return: resource name -> fingerprint, empty if setup did not save a baseline
+        :rtype: dict
+        """
+        try:
+            with open(self.path) as baseline_file:
+                return json.load(baseline_file)
+        except (IOError, ValueError):
+            return {}
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _write(self, baseline):
+        atomic_write(self.path, lambda baseline_file: json.dump(baseline, baseline_file))
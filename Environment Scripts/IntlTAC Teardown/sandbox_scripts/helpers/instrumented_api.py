@@ -0,0 +1,105 @@
+import json
+import time
+from threading import Lock
+
+from sandbox_scripts.profiler.tracer import is_tracing, span
+
+
+class ApiMethodStats(object):
+    def __init__(self):
+        self.latencies = []
+        self.errors = {}
+
+    def percentile(self, percent):
+        """
+        :param float percent: 0-100
+        :return: latency in seconds, nearest rank
+        :rtype: float
+        """
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, max(0, int(round(percent / 100.0 * len(latencies))) - 1))]
+
+
+class InstrumentedApiSession(object):
+    """
+    Transparent wrapper of a CloudShellAPISession counting the calls of every API method with their latency and
+    error codes. Calls are also recorded as spans when tracing is enabled.
+    """
+
+    def __init__(self, api):
+        """
+        :param CloudShellAPISession api:
+        """
+        self._api = api
+        self._stats = {}
+        self._lock = Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._api, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            # repr keeps non-ASCII unicode arguments printable, the arguments are only formatted for the trace
+            call_args = ', '.join(repr(arg) for arg in args[:3])[:200] if is_tracing() else None
+            started = time.time()
+            error = None
+            try:
+                with span(name, 'api', call_args=call_args):
+                    return attribute(*args, **kwargs)
+            except Exception as exc:
+                error = str(getattr(exc, 'code', None) or type(exc).__name__)
+                raise
+            finally:
+                self._record(name, time.time() - started, error)
+        return call
+
+    def _record(self, name, latency, error):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = ApiMethodStats()
+            stats.latencies.append(latency)
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+
+    def summary(self):
+        """
+        :return: table of the calls of every API method, most called first
+        :rtype: str
+        """
+        with self._lock:
+            methods = sorted(self._stats.items(), key=lambda item: (-len(item[1].latencies), item[0]))
+            if not methods:
+                return 'No API calls'
+            name_width = max(len(name) for name, _ in methods)
+            lines = ['{0}  {1:>6}  {2:>8}  {3:>8}  {4:>8}  {5:>8}  {6:>8}  {7}'.format(
+                'API method'.ljust(name_width), 'Calls', 'Total s', 'p50 s', 'p90 s', 'p99 s', 'Max s', 'Errors')]
+            for name, stats in methods:
+                lines.append('{0}  {1:>6}  {2:>8.2f}  {3:>8.3f}  {4:>8.3f}  {5:>8.3f}  {6:>8.3f}  {7}'.format(
+                    name.ljust(name_width), len(stats.latencies), sum(stats.latencies), stats.percentile(50),
+                    stats.percentile(90), stats.percentile(99), max(stats.latencies),
+                    ', '.join('{0} x{1}'.format(code, count) for code, count in sorted(stats.errors.items()))))
+            lines.append('{0}  {1:>6}  {2:>8.2f}'.format('Total'.ljust(name_width),
+                                                        sum(len(stats.latencies) for _, stats in methods),
+                                                        sum(sum(stats.latencies) for _, stats in methods)))
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        """
+        :param str path: file receiving method -> calls, total and percentile latencies in seconds, error counts
+        """
+        with self._lock:
+            content = dict((name, {
+                'calls': len(stats.latencies),
+                'total': sum(stats.latencies),
+                'p50': stats.percentile(50),
+                'p90': stats.percentile(90),
+                'p99': stats.percentile(99),
+                'max': max(stats.latencies),
+                'errors': dict(stats.errors)
+            }) for name, stats in self._stats.items())
+        with open(path, 'w') as json_file:
+            json.dump(content, json_file, indent=2, sort_keys=True)
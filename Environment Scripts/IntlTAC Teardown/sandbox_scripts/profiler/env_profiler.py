@@ -1,20 +1,70 @@
-import cProfile, pstats, os
+import pstats, os
+from sandbox_scripts.profiler.sampler import StackSampler, merge_collapsed
+from sandbox_scripts.profiler.thread_profiler import ThreadProfiler
+from sandbox_scripts.profiler.tracer import span, start_tracing, stop_tracing
 
 ### http://stackoverflow.com/questions/5375624/a-decorator-that-profiles-a-method-call-and-logs-the-profiling-result ###
 def profileit(scriptName):
+    """
+    Profiles, traces and samples the decorated call as enabled by the quali_profiling, quali_tracing and
+    quali_sampling global inputs. Profiling never fails the reservation, output that cannot be saved is only logged.
+    """
     def inner(func):
         from cloudshell.helpers.scripts import cloudshell_scripts_helpers as helpers
+        from cloudshell.core.logger import qs_logger
         profiling = helpers.get_global_inputs().get('quali_profiling')
+        tracing = helpers.get_global_inputs().get('quali_tracing')
+        sampling = helpers.get_global_inputs().get('quali_sampling')
+        try:
+            sampling_interval = float(helpers.get_global_inputs().get('quali_sampling_interval') or 0.05)
+        except ValueError:
+            sampling_interval = 0.05
         reservation_context = helpers.get_reservation_context_details()
         reservation_id = reservation_context.id
         environment_name = reservation_context.environment_name
+        logger = qs_logger.get_qs_logger(log_file_prefix="CloudShell Sandbox " + scriptName, log_group=reservation_id,
+                                         log_category=scriptName)
+        def traced(*args, **kwargs):
+            if not tracing:
+                return func(*args, **kwargs)
+            start_tracing()
+            try:
+                with span(scriptName, 'script', reservation=reservation_id):
+                    return func(*args, **kwargs)
+            finally:
+                # Chrome trace event format, open in chrome://tracing or ui.perfetto.dev
+                try:
+                    stop_tracing(os.path.join(tracing, scriptName + "_" + environment_name + "_" + reservation_id +
+                                              ".trace.json"))
+                except Exception as exc:
+                    logger.warning('Unable to save trace. Error: {0}'.format(str(exc)))
+        def sampled(*args, **kwargs):
+            if not sampling:
+                return traced(*args, **kwargs)
+            sampler = StackSampler(sampling_interval)
+            sampler.start()
+            try:
+                return traced(*args, **kwargs)
+            finally:
+                sampler.stop()
+                # one collapsed stacks file per script, aggregated over all the reservations
+                try:
+                    merge_collapsed(os.path.join(sampling, scriptName + ".collapsed"), sampler.counts)
+                except Exception as exc:
+                    logger.warning('Unable to save sampled stacks. Error: {0}'.format(str(exc)))
         def wrapper(*args, **kwargs):
             if not profiling:
-                return func(*args, **kwargs)
-            prof = cProfile.Profile()
-            retval = prof.runcall(func, *args, **kwargs)
+                return sampled(*args, **kwargs)
+            # worker threads are profiled too, their stats are merged with those of the calling thread
+            thread_profiler = ThreadProfiler()
+            thread_profiler.start()
+            try:
+                retval = thread_profiler.profile_call(sampled, *args, **kwargs)
+            finally:
+                thread_profiler.stop()
             s = open(os.path.join(profiling, scriptName + "_" + environment_name + "_" + reservation_id + ".text"), 'w')
-            stats = pstats.Stats(prof, stream=s)
+            thread_profiler.print_breakdown(s)
+            stats = pstats.Stats(*[record.profile for record in thread_profiler.records], stream=s)
             stats.strip_dirs().sort_stats('cumtime').print_stats()
             return retval
         return wrapper
@@ -0,0 +1,83 @@
+import os
+import re
+import sys
+import threading
+from collections import defaultdict
+
+from sandbox_scripts.helpers.file_utils import FileLock, atomic_write, make_dirs
+
+
+class StackSampler(object):
+    """
+    Wall clock sampling profiler: a background thread records the stack of every other thread each interval
+    seconds. Stacks are kept in the collapsed format used by flamegraph.pl and speedscope, one
+    'thread;outer frame;...;inner frame count' line per distinct stack.
+    """
+
+    def __init__(self, interval=0.05):
+        """
+        :param float interval: seconds between two samples
+        """
+        self.interval = interval
+        self.counts = defaultdict(int)
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='StackSampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.current_thread().ident
+        while not self._stop.wait(self.interval):
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append('{0} ({1})'.format(code.co_name, os.path.basename(code.co_filename)))
+                    frame = frame.f_back
+                frames.append(self._thread_group(names.get(thread_id, 'unknown')))
+                self.counts[';'.join(reversed(frames))] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _thread_group(thread_name):
+        """
+        Thread names without device names and counters, so stacks aggregate across reservations,
+        e.g. 'firmware:GV-HC2-1' -> 'firmware', 'Thread-12' -> 'Thread'
+        """
+        return re.sub(r'-\d+$', '', thread_name.split(':')[0])
+
+
+def merge_collapsed(path, counts, timeout=30, stale_after=120):
+    """
+    Adds counts to the collapsed stacks file at path, shared by all the reservations of the execution server
+    :param str path:
+    :param dict counts: collapsed stack -> number of samples
+    """
+    make_dirs(os.path.dirname(path))
+    with FileLock(path + '.lock', timeout, stale_after):
+        merged = defaultdict(int)
+        if os.path.exists(path):
+            with open(path) as collapsed_file:
+                for line in collapsed_file:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    if stack and count.isdigit():
+                        merged[stack] += int(count)
+        for stack, count in counts.items():
+            merged[stack] += count
+
+        def write(collapsed_file):
+            for stack in sorted(merged):
+                collapsed_file.write('{0} {1}\n'.format(stack, merged[stack]))
+        atomic_write(path, write)
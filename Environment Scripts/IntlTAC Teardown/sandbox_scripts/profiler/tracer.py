@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_tracer = None
+
+
+class Tracer(object):
+    """
+    Collects timed spans from all the threads of the script and writes them in the Chrome trace event format,
+    which chrome://tracing and Perfetto display as one timeline per thread
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.pid = os.getpid()
+        self._events = []
+        self._thread_names = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, category, started, duration, args=None):
+        """
+        :param str name:
+        :param str category: e.g. 'task', 'device', 'api'
+        :param float started: time.time() when the span started
+        :param float duration: seconds
+        :param dict args: shown with the span in the viewer
+        """
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int((started - self.started) * 1000000),
+            'dur': int(duration * 1000000),
+            'pid': self.pid,
+            'tid': thread.ident
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+            self._thread_names.setdefault(thread.ident, thread.name)
+
+    def write(self, path):
+        with self._lock:
+            events = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                      for tid, name in self._thread_names.items()]
+            events.extend(self._events)
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+
+def start_tracing():
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def is_tracing():
+    """
+    :return: whether spans are being recorded
+    :rtype: bool
+    """
+    return _tracer is not None
+
+
+def stop_tracing(path):
+    """
+    Writes the trace collected since start_tracing to path
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.write(path)
+
+
+@contextmanager
+def span(name, category, **args):
+    """
+    Records the enclosed block as a span, does nothing unless tracing was started
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    started = time.time()
+    try:
+        yield
+    finally:
+        tracer.add_span(name, category, started, time.time() - started, args)
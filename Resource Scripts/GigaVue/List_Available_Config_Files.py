@@ -1,5 +1,16 @@
 import cloudshell.helpers.scripts.cloudshell_scripts_helpers as helpers
 import ftplib
+import json
+import os
+import tempfile
+import time
+from file_utils import FileLock, atomic_write, make_dirs
+
+# Same location as the firmware version index cache, shared by the resource scripts of the execution server
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'gigamon_cache')
+# listings younger than LISTING_TTL seconds are used without contacting the FTP server, older ones are checked
+# with MLST before they are used and only listed again when the directory changed
+LISTING_TTL = 60
 
 def get_ftp(api, reservation):
     """
@@ -25,6 +36,78 @@ def get_ftp(api, reservation):
 
     return server, user, password
 
+
+def get_listing_cache_path(ftp_host):
+    return os.path.join(CACHE_DIR, 'ftp_listing_{0}.json'.format(ftp_host))
+
+
+def read_listing_cache(ftp_host):
+    """
+    :return: path -> {'listed': time of the listing, 'stamp': MLST modify fact or None, 'entries': nlst result}
+    :rtype: dict
+    """
+    try:
+        with open(get_listing_cache_path(ftp_host)) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def update_listing_cache(ftp_host, listings):
+    """
+    Merges listings into the cache file, other scripts may have added other paths since it was read
+    """
+    make_dirs(CACHE_DIR)
+    cache_path = get_listing_cache_path(ftp_host)
+    with FileLock(cache_path + '.lock'):
+        cache = read_listing_cache(ftp_host)
+        cache.update(listings)
+        atomic_write(cache_path, lambda cache_file: json.dump(cache, cache_file))
+
+
+def get_modify_stamp(ftp, path):
+    """
+    :return: modify fact of the directory from MLST, None if the server does not support it
+    """
+    try:
+        response = ftp.sendcmd('MLST ' + path)
+    except Exception:
+        return None
+    for fact in response.replace('\n', ';').replace(' ', ';').split(';'):
+        if fact.lower().startswith('modify='):
+            return fact[len('modify='):]
+    return None
+
+
+def is_directory_not_found(exc):
+    """
+    :param ftplib.error_perm exc:
+    :return: whether the server answered 550 because the directory does not exist, not e.g. for permissions
+    :rtype: bool
+    """
+    message = str(exc).lower()
+    return message.startswith('550') and ('not found' in message or 'no such file' in message)
+
+
+def list_directory(ftp, path, cached=None):
+    """
+    Lists path, the cached listing is reused without a nlst when MLST reports the directory unchanged
+
+    :return: cache entry of the listing
+    :rtype: dict
+    """
+    stamp = get_modify_stamp(ftp, path)
+    if stamp is not None and cached is not None and cached.get('stamp') == stamp:
+        return {'listed': time.time(), 'stamp': stamp, 'entries': cached['entries']}
+    try:
+        entries = ftp.nlst(path)
+    except ftplib.error_perm as exc:
+        if not is_directory_not_found(exc):
+            raise
+        entries = []
+    return {'listed': time.time(), 'stamp': stamp, 'entries': entries}
+
+
 ses = helpers.get_api_session()
 reservation = helpers.get_reservation_context_details()
 resource = helpers.get_resource_context_details()
@@ -32,35 +115,45 @@ resource_model = resource.attributes['Model']
 
 remote_host, user, password = get_ftp(ses, reservation)
 
-try:
-    ftp = ftplib.FTP(remote_host)
-    ftp.login(user,password)
+device_path = 'Configs/Devices/' + resource.name
+model_path = 'Configs/Models/' + resource_model
 
-except Exception as exc:
-    ses.WriteMessageToReservationOutput(reservation.id,
-                                        'Unable to connect to FTP server to retreive list. Error: {0}'.format(str(exc)))
-    raise exc
+cache = read_listing_cache(remote_host)
+now = time.time()
+expired = [path for path in (device_path, model_path)
+           if path not in cache or now - cache[path]['listed'] > LISTING_TTL]
+
+if expired:
+    try:
+        ftp = ftplib.FTP(remote_host)
+        ftp.login(user,password)
+
+    except Exception as exc:
+        ses.WriteMessageToReservationOutput(reservation.id,
+                                            'Unable to connect to FTP server to retreive list. Error: {0}'.format(str(exc)))
+        raise exc
 
-version_lines=[]
-device_configs = []
-try:
-    device_configs = ftp.nlst('Configs/Devices/' + resource.name)
+    listings = {}
+    try:
+        for path in expired:
+            listings[path] = list_directory(ftp, path, cache.get(path))
 
-except Exception as exc:
-    if exc.message == '550 Directory not found.':
-        device_configs = []
-    else:
+    except Exception as exc:
         ses.WriteMessageToReservationOutput(reservation.id,
-                                        'Unable to retrieve list of configs from FTP. Error: {0}'.format(str(exc)))
+                                            'Unable to retrieve list of configs from FTP. Error: {0}'.format(str(exc)))
 
-try:
-    model_configs = ftp.nlst('Configs/Models/' + resource_model)
+        raise exc
+    finally:
+        ftp.close()
 
-except Exception as exc:
-    ses.WriteMessageToReservationOutput(reservation.id,
-                                        'Unable to retrieve list of configs from FTP. Error: {0}'.format(str(exc)))
+    cache.update(listings)
+    try:
+        update_listing_cache(remote_host, listings)
+    except Exception:
+        pass
 
-    raise exc
+device_configs = cache[device_path]['entries']
+model_configs = cache[model_path]['entries']
 
 
 print '\n========================\nAvailable Configs Full Path\n========================'
@@ -71,4 +164,4 @@ if len(device_configs) > 0:
 
 print 'For any device of model ' + resource_model
 for config in model_configs:
-    print '--' + config
\ No newline at end of file
+    print '--' + config
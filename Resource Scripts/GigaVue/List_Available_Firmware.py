@@ -1,6 +1,14 @@
 import cloudshell.helpers.scripts.cloudshell_scripts_helpers as helpers
 import ftplib
+import json
+import os
+import tempfile
 from cloudshell.api.cloudshell_api import CloudShellAPISession
+from file_utils import FileLock, atomic_write, make_dirs
+
+VERSION_INDEX_FILE = 'version_index.txt'
+# Same location and format as the setup script's FirmwareIndexCache, so both share the cache
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'gigamon_cache')
 
 def get_ftp(api, reservation):
     """
@@ -27,6 +35,98 @@ def get_ftp(api, reservation):
     return server, user, password
 
 
+class VersionIndexParser(object):
+    """
+    Single pass parser of version_index.txt fed with retrbinary blocks, see the setup script's firmware_index
+    """
+    BOM = '\xef\xbb\xbf'
+
+    def __init__(self):
+        self.version_lookup = {}
+        self.bad_lines = []
+        self._pending = ''
+        self._line_number = 0
+
+    def feed(self, chunk):
+        data = self._pending + chunk
+        keep = ''
+        if data.endswith('\r'):  # may be the first half of '\r\n'
+            data, keep = data[:-1], '\r'
+        lines = data.splitlines(True)
+        if lines and not lines[-1].endswith(('\r', '\n')):
+            keep = lines.pop() + keep
+        self._pending = keep
+
+        for line in lines:
+            self._parse_line(line)
+
+    def close(self):
+        if self._pending:
+            self._parse_line(self._pending)
+            self._pending = ''
+        return self.version_lookup
+
+    def _parse_line(self, line):
+        self._line_number += 1
+        if self._line_number == 1 and line.startswith(VersionIndexParser.BOM):
+            line = line[len(VersionIndexParser.BOM):]
+        line = line.strip()
+        if not line:
+            return
+
+        fields = [field.strip() for field in line.split(',')]
+        if len(fields) != 3 or not all(fields):
+            self.bad_lines.append((self._line_number, line))
+            return
+
+        model, version_string, path = fields
+        if model not in self.version_lookup:
+            self.version_lookup[model] = {}
+        self.version_lookup[model][version_string] = path
+
+
+def load_version_index(ftp, ftp_host):
+    """
+    Returns the parsed version_index.txt, from the local cache when MDTM/SIZE of the remote file are unchanged
+
+    :type ftp: ftplib.FTP
+    :type ftp_host: str
+    :return: model -> version -> image path, and the (line number, line) of every malformed line
+    :rtype: (dict, list)
+    """
+    cache_path = os.path.join(CACHE_DIR, 'version_index_{0}.json'.format(ftp_host))
+    try:
+        stamp = [ftp.sendcmd('MDTM ' + VERSION_INDEX_FILE).split()[-1], ftp.size(VERSION_INDEX_FILE)]
+    except Exception:
+        stamp = None
+
+    if stamp is not None:
+        try:
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)
+            if cached.get('stamp') == stamp:
+                return cached['index'], [tuple(bad_line) for bad_line in cached.get('bad_lines', [])]
+        except (IOError, ValueError):
+            pass
+
+    parser = VersionIndexParser()
+    ftp.retrbinary('retr ' + VERSION_INDEX_FILE, parser.feed)
+    version_lookup = parser.close()
+
+    if stamp is not None:
+        try:
+            write_cache(cache_path, {'stamp': stamp, 'index': version_lookup, 'bad_lines': parser.bad_lines})
+        except Exception:
+            pass
+    return version_lookup, parser.bad_lines
+
+
+def write_cache(cache_path, content):
+    make_dirs(CACHE_DIR)
+    with FileLock(cache_path + '.lock'):
+        atomic_write(cache_path, lambda cache_file: json.dump(content, cache_file))
+
+
 ses = helpers.get_api_session()
 reservation = helpers.get_reservation_context_details()
 resource = helpers.get_resource_context_details()
@@ -43,34 +143,21 @@ except Exception as exc:
                                         'Unable to connect to FTP server to retreive list. Error: {0}'.format(str(exc)))
     raise exc
 
-version_lines=[]
 try:
-    ftp.retrbinary('retr version_index.txt', version_lines.append)
+    version_lookup, bad_lines = load_version_index(ftp, remote_host)
 except Exception as exc:
     ses.WriteMessageToReservationOutput(reservation.id,
                                         'Unable to retrieve list of images from FTP. Error: {0}'.format(str(exc)))
 
     raise exc
 
-try:
-    version_lines = version_lines[0].split('\r')
-    version_lines  = map(str.strip, version_lines)
-    version_lookup = {}
-
-except Exception as exc:
+if bad_lines:
     ses.WriteMessageToReservationOutput(reservation.id,
-                                        'Unable to parse fimware version list. Error: {}'.format(str(exc)))
-    raise exc
+                                        'Skipped malformed lines in version_index.txt: {0}'
+                                        .format(', '.join(str(line_number) for line_number, line in bad_lines)))
 
 print '\n========================\nAvailable Versions\n[Version]: [File_Name]\n========================'
 
-for line in version_lines:
-    model, version_string, path = line.split(',')
-    if model not in version_lookup:
-        version_lookup[model] = {}
-    version_lookup[model][version_string] = path
-
-
-for ver, file in version_lookup[resource_model].iteritems():
+for ver, file in version_lookup.get(resource_model, {}).iteritems():
     print ver + ': ' + file
 
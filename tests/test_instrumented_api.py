@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that InstrumentedApiSession passes every call through to the API session, in the Setup and Teardown packages.
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_PACKAGES = [os.path.join(REPO_DIR, 'Environment Scripts', 'IntlTAC Setup'),
+                   os.path.join(REPO_DIR, 'Environment Scripts', 'IntlTAC Teardown')]
+
+
+class FakeApiSession(object):
+    def GetResourceDetails(self, resourceFullPath):
+        return resourceFullPath
+
+
+def import_package(package_dir):
+    """
+    Imports the sandbox_scripts modules of package_dir, the packages share the sandbox_scripts name
+    :return: instrumented_api and tracer modules
+    :rtype: tuple
+    """
+    for module_name in [module_name for module_name in sys.modules if module_name.split('.')[0] == 'sandbox_scripts']:
+        del sys.modules[module_name]
+    sys.path.insert(0, package_dir)
+    try:
+        from sandbox_scripts.helpers import instrumented_api
+        from sandbox_scripts.profiler import tracer
+    finally:
+        sys.path.remove(package_dir)
+    return instrumented_api, tracer
+
+
+class InstrumentedApiSessionTest(unittest.TestCase):
+    NAME = u'GigaVue-\xe9'
+
+    def test_non_ascii_argument(self):
+        for package_dir in SCRIPT_PACKAGES:
+            instrumented_api, _ = import_package(package_dir)
+            api = instrumented_api.InstrumentedApiSession(FakeApiSession())
+            self.assertEqual(api.GetResourceDetails(self.NAME), self.NAME)
+            self.assertIn('GetResourceDetails', api.summary())
+
+    def test_non_ascii_argument_traced(self):
+        for package_dir in SCRIPT_PACKAGES:
+            instrumented_api, tracer = import_package(package_dir)
+            api = instrumented_api.InstrumentedApiSession(FakeApiSession())
+            tracer.start_tracing()
+            try:
+                self.assertEqual(api.GetResourceDetails(self.NAME), self.NAME)
+            finally:
+                handle, trace_path = tempfile.mkstemp(suffix='.json')
+                os.close(handle)
+                tracer.stop_tracing(trace_path)
+            with open(trace_path) as trace_file:
+                self.assertIn('GigaVue-', trace_file.read())
+            os.remove(trace_path)
+
+
+if __name__ == '__main__':
+    unittest.main()